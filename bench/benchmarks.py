@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Headless micro-benchmarks of the map components against synthetic charts.
+# Results are written as JSON; give --compare a previous results file to
+# see the change of each benchmark.
+
+import sys, os
+import json
+import time
+import math
+import shutil
+import platform
+import argparse
+import tempfile
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+    from PyQt5.QtWidgets import *
+except:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+import numpy
+
+import pyavmap
+import pyavmap.avchart_proj as proj
+import pyavmap.catalog as catalog
+from pyavmap.tile_cache import tiles
+from pyavmap.renderer import MapRenderer
+import synthetic_charts
+
+RESULTS_VERSION = 1
+
+# Ownship position used throughout, inside both Alpha and L1
+LON = -99.5
+LAT = 38.0
+
+# Calls setup (if any) then fn, repeats times, and summarizes the time of fn.
+# per is the number of operations one call of fn does.
+def timeit(fn, repeats, setup=None, per=1):
+    times = list()
+    for i in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000.0 / per)
+    times.sort()
+    return {'runs': repeats, 'per_run': per,
+            'min_ms': times[0],
+            'median_ms': times[len(times) // 2],
+            'mean_ms': sum(times) / len(times),
+            'max_ms': times[-1]}
+
+def bench_configure(args, charts_dir, results):
+    catalog_name = os.path.join(charts_dir, catalog.CATALOG_FILE)
+    if os.path.exists(catalog_name):
+        os.remove(catalog_name)
+    results['configure_charts.scan'] = timeit(
+            lambda: pyavmap.configure_charts(charts_dir), args.repeats)
+    catalog.build_catalog(charts_dir)
+    results['configure_charts.catalog'] = timeit(
+            lambda: pyavmap.configure_charts(charts_dir), args.repeats)
+
+def bench_charts(args, charts_dir, results):
+    pyavmap.configure_charts(charts_dir)
+    results['find_charts.cold'] = timeit(
+            lambda: proj.find_charts('Sectional', LON, LAT, charts_dir, 800, 600, 1.0),
+            args.repeats, setup=proj.clear_chart_cache)
+    results['find_charts.warm'] = timeit(
+            lambda: proj.find_charts('Sectional', LON, LAT, charts_dir, 800, 600, 1.0),
+            args.repeats)
+
+    base_name = os.path.join(charts_dir, 'Sectional', 'Alpha', 'Alpha')
+    info = proj.chart_info.get(('Sectional', 'Alpha'))
+    results['AvChart.init.metadata'] = timeit(
+            lambda: proj.AvChart('Alpha', base_name, False), args.repeats)
+    if info is not None:
+        results['AvChart.init.catalog'] = timeit(
+                lambda: proj.AvChart('Alpha', base_name, False, info), args.repeats)
+
+    chart = proj.AvChart('Alpha', base_name, False)
+    # A few minutes of flight, as a stream of ownship positions
+    n = 1000
+    lons = numpy.linspace(LON, LON + 0.1, n)
+    lats = numpy.linspace(LAT, LAT + 0.05, n)
+    points = list(zip(lons.tolist(), lats.tolist()))
+    def proj_each():
+        for lon,lat in points:
+            chart.proj(lon, lat)
+    def proj_fast_each():
+        for lon,lat in points:
+            chart.proj_fast(lon, lat)
+    results['AvChart.proj'] = timeit(proj_each, args.repeats, per=n)
+    results['AvChart.proj_fast'] = timeit(proj_fast_each, args.repeats, per=n)
+    results['AvChart.proj_many.1000'] = timeit(lambda: chart.proj_many(lons, lats), args.repeats)
+
+    for zoom in args.zooms:
+        results['construct_pixmap.cold.%g'%zoom] = timeit(
+                lambda: chart.construct_pixmap(LON, LAT, args.width, args.height, zoom),
+                args.repeats, setup=tiles.clear)
+        results['construct_pixmap.warm.%g'%zoom] = timeit(
+                lambda: chart.construct_pixmap(LON, LAT, args.width, args.height, zoom),
+                args.repeats)
+
+def bench_paint(args, charts_dir, results):
+    pyavmap.configure_charts(charts_dir)
+    config = {'charts_dir': charts_dir, 'show_path': True, 'max_frame_rate': 0,
+              'prefetch_seconds': 0, 'pxmap_update_period': 1e9}
+    avmap = pyavmap.AvMap(config)
+    avmap.resize(args.width // avmap.scene_size_multiplier, args.height // avmap.scene_size_multiplier)
+    avmap.show()
+    QApplication.processEvents()
+    avmap.setPosition(LAT, LON, 45)
+    # A long recorded track to draw
+    for i in range(args.track_points):
+        avmap._lat = LAT + 0.1 * math.sin(i / 50.0)
+        avmap._lon = LON + 0.1 * math.cos(i / 70.0)
+        avmap.last_path_time = 0
+        avmap.record_track()
+    avmap._lat,avmap._lon = LAT,LON
+    QApplication.processEvents()
+    results['AvMap.paintEvent'] = timeit(lambda: avmap.viewport().repaint(), args.repeats)
+    avmap.render_worker.stop()
+
+# Frames along a short flight from one MapRenderer, in each orientation
+def bench_render(args, charts_dir, results):
+    pyavmap.configure_charts(charts_dir)
+    renderer = MapRenderer({'charts_dir': charts_dir, 'show_path': True})
+    for i in range(args.track_points):
+        renderer.add_path_point(LON - 0.1 + 0.1 * i / args.track_points, LAT + 0.02 * math.sin(i / 50.0))
+    n = 100
+    for north_is_up in (True, False):
+        def frames():
+            for i in range(n):
+                renderer.render(LAT, LON + i * 0.0005, 90, args.render_width, args.render_height,
+                                north_is_up=north_is_up)
+        renderer.render(LAT, LON, 90, args.render_width, args.render_height, north_is_up=north_is_up)
+        results['MapRenderer.render.%s'%('north_up' if north_is_up else 'track_up')] = \
+                    timeit(frames, args.repeats, per=n)
+
+def compare(results, baseline_name):
+    with open(baseline_name, 'r') as f:
+        baseline = json.load(f)['results']
+    print ("\n%-32s %12s %12s %8s"%('benchmark', 'baseline ms', 'median ms', 'change'))
+    for name,r in results.items():
+        if name in baseline:
+            old = baseline[name]['median_ms']
+            change = (r['median_ms'] - old) / old * 100.0 if old > 0 else 0.0
+            print ("%-32s %12.4f %12.4f %+7.1f%%"%(name, old, r['median_ms'], change))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pyAvMap components on synthetic charts')
+    parser.add_argument('--output', '-o', default='bench_results.json', help='Results file to write')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--charts-dir', help='Use (or create) synthetic charts here instead of a temporary directory')
+    parser.add_argument('--chart-width', type=int, default=4000)
+    parser.add_argument('--chart-height', type=int, default=3000)
+    parser.add_argument('--layout', type=int, default=synthetic_charts.TILE_LAYOUT_LEVELS,
+                        choices=[synthetic_charts.TILE_LAYOUT_LEGACY, synthetic_charts.TILE_LAYOUT_LEVELS])
+    parser.add_argument('--tile-size', type=int, default=512)
+    parser.add_argument('--paletted', action='store_true')
+    parser.add_argument('--pack', action='store_true')
+    parser.add_argument('--width', type=int, default=2000, help='Width of the constructed pixmap')
+    parser.add_argument('--height', type=int, default=1400, help='Height of the constructed pixmap')
+    parser.add_argument('--render-width', type=int, default=640, help='Width of MapRenderer frames')
+    parser.add_argument('--render-height', type=int, default=480, help='Height of MapRenderer frames')
+    parser.add_argument('--zooms', type=float, nargs='+', default=[0.3, 0.5, 1.0, 1.5])
+    parser.add_argument('--track-points', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    temp_dir = None
+    charts_dir = args.charts_dir
+    if charts_dir is None:
+        temp_dir = tempfile.mkdtemp(prefix='avmap-bench-')
+        charts_dir = temp_dir
+    results = dict()
+    try:
+        if not os.path.exists(os.path.join(charts_dir, 'Sectional')):
+            start = time.time()
+            synthetic_charts.make_chart_set(charts_dir, args.chart_width, args.chart_height,
+                        layout=args.layout, tile_size=args.tile_size,
+                        paletted=args.paletted, pack=args.pack)
+            print ("Wrote synthetic charts to %s in %.1f seconds"%(charts_dir, time.time() - start))
+        bench_configure(args, charts_dir, results)
+        bench_charts(args, charts_dir, results)
+        bench_paint(args, charts_dir, results)
+        bench_render(args, charts_dir, results)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    print ("%-32s %10s %10s %10s"%('benchmark', 'min ms', 'median ms', 'max ms'))
+    for name,r in results.items():
+        print ("%-32s %10.4f %10.4f %10.4f"%(name, r['min_ms'], r['median_ms'], r['max_ms']))
+    output = {'version': RESULTS_VERSION,
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'platform': {'machine': platform.machine(), 'system': platform.platform(),
+                           'python': platform.python_version(), 'qt': QT_VERSION_STR},
+              'args': vars(args),
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Records the FIX items pyAvMap uses from a live FIX Gateway, for
+# fix_replay.py
+
+import sys, os
+import signal
+import argparse
+import yaml
+
+try:
+    from PyQt5.QtCore import *
+except:
+    from PyQt4.QtCore import *
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fixlog import FixLogWriter, KEYS
+
+if "pyAvTools" not in ''.join(sys.path):
+    neighbor_tools = os.path.join ('..', 'pyAvTools')
+    if os.path.isdir (neighbor_tools):
+        sys.path.append (neighbor_tools)
+    elif 'TOOLS_PATH' in os.environ:
+        sys.path.append (os.environ['TOOLS_PATH'])
+
+try:
+    import pyavtools.fix as fix
+except:
+    print ("You need to have pyAvTools installed, or in an adjacent directory to pyAvMap.")
+    print ("Or set the environment variable 'TOOLS_PATH' to point to the location of pyAvTools.")
+    sys.exit(-1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Record FIX values for replay into pyAvMap')
+    parser.add_argument('output', help='FIX log file to write')
+    parser.add_argument('--config-file', default='config/main.yaml', type=argparse.FileType('r'),
+                        help='pyAvMap configuration, for the FIX server address')
+    parser.add_argument('--duration', type=float, default=0,
+                        help='Seconds to record (default until interrupted)')
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+    config = yaml.safe_load(args.config_file)
+    fix.initialize(config)
+    writer = FixLogWriter(args.output)
+    for key in KEYS:
+        item = fix.db.get_item(key)
+        writer.write(key, item.value)
+        item.valueChanged[float].connect(lambda value, key=key: writer.write(key, value))
+
+    signal.signal(signal.SIGINT, lambda *a: app.quit())
+    # Lets the interpreter see the interrupt while the event loop runs
+    poll = QTimer()
+    poll.timeout.connect(lambda: None)
+    poll.start(200)
+    if args.duration > 0:
+        QTimer.singleShot(int(args.duration * 1000), app.quit)
+    app.exec_()
+    fix.stop()
+    writer.close()
+    print ("Recorded %d values to %s"%(writer.count, args.output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Replays a FIX log into an AvMap through a stand-in FIX database, wired
+# the way pyAvMap.py wires the real one, and reports the latency from each
+# position update to the frame that shows it, merged updates, updates
+# that stalled, and the time and drops of background refreshes.
+
+import sys, os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import yaml
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+    from PyQt5.QtWidgets import *
+except:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+import pyavmap
+from fixlog import read_fix_log, synthetic_flight, StandInDb
+import synthetic_charts
+
+# Seconds to keep running after the last record, for the last frames
+SETTLE_TIME = 1.0
+
+# AvMap that timestamps position updates as they arrive, are applied and
+# are painted, and times background refreshes from the first request made
+# to the render worker to the frame it hands back
+class InstrumentedAvMap(pyavmap.AvMap):
+    def __init__(self, config, stall_ms, parent=None):
+        super(InstrumentedAvMap, self).__init__(config, parent)
+        self.stall_ms = stall_ms
+        self.refresh_start = None
+        self.refreshes = list()
+        submit = self.render_worker.submit
+        def timed_submit(request):
+            if self.refresh_start is None:
+                self.refresh_start = time.perf_counter()
+            submit(request)
+        self.render_worker.submit = timed_submit
+        self.arrived = list()       # times of updates not yet applied
+        self.applied = list()       # times of updates applied but not yet painted
+        self.latencies = list()
+        self.updates = 0
+        self.positions = 0
+        self.unmoved = 0
+        self.paints = 0
+        self.stalls = 0
+
+    def fix_update(self):
+        self.updates += 1
+        self.arrived.append(time.perf_counter())
+
+    # Updates that do not move the view by a whole pixel need no frame, so
+    # only those that scroll it are timed to the paint
+    def setPosition(self, lat, lon, track=None):
+        moved = lat != self._lat or lon != self._lon
+        scroll = (self.horizontalScrollBar().value(), self.verticalScrollBar().value())
+        super(InstrumentedAvMap, self).setPosition(lat, lon, track)
+        if moved:
+            self.positions += 1
+            if scroll != (self.horizontalScrollBar().value(), self.verticalScrollBar().value()):
+                self.applied.extend(self.arrived)
+            else:
+                self.unmoved += len(self.arrived)
+            self.arrived = list()
+
+    def paintEvent(self, event):
+        super(InstrumentedAvMap, self).paintEvent(event)
+        now = time.perf_counter()
+        self.paints += 1
+        latencies = [(now - t) * 1000.0 for t in self.applied]
+        self.latencies.extend(latencies)
+        self.stalls += len([l for l in latencies if l > self.stall_ms])
+        self.applied = list()
+
+    def accept_frame(self, frame):
+        if frame.generation == self.frame_generation and self.refresh_start is not None:
+            self.refreshes.append((time.perf_counter() - self.refresh_start) * 1000.0)
+            self.refresh_start = None
+        super(InstrumentedAvMap, self).accept_frame(frame)
+
+class Replayer:
+    def __init__(self, records, db, speed):
+        self.records = records
+        self.db = db
+        self.speed = speed
+        self.next = 0
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.play)
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.play()
+
+    # Sets every value that is due, then sleeps until the next one. Quits
+    # the application SETTLE_TIME after the last.
+    def play(self):
+        elapsed = (time.perf_counter() - self.start_time) * self.speed
+        while self.next < len(self.records) and self.records[self.next][0] <= elapsed:
+            t,key,value = self.records[self.next]
+            self.db.get_item(key).value = value
+            self.next += 1
+        if self.next < len(self.records):
+            wait = (self.records[self.next][0] - elapsed) / self.speed
+            self.timer.start(max(int(wait * 1000), 0))
+        else:
+            QTimer.singleShot(int(SETTLE_TIME * 1000), QApplication.quit)
+
+def percentile(values, p):
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a FIX log into pyAvMap and measure it')
+    parser.add_argument('log', nargs='?', help='FIX log written by fix_record.py')
+    parser.add_argument('--config-file', type=argparse.FileType('r'),
+                        help='pyAvMap configuration for the map (default config/main.yaml settings are not used)')
+    parser.add_argument('--charts-dir', help='Charts directory (default charts_dir of the configuration)')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='Replay a synthetic flight over synthetic charts instead of a log')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed, 1 for real time')
+    parser.add_argument('--width', type=int, default=1000, help='Map width')
+    parser.add_argument('--height', type=int, default=700, help='Map height')
+    parser.add_argument('--stall-ms', type=float, default=250.0,
+                        help='A position update shown more than this many ms after it arrived is a stall')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    if args.log is None and not args.synthetic:
+        parser.error('Give a FIX log or --synthetic')
+    if not args.synthetic and not os.path.exists(args.log):
+        parser.error('%s does not exist'%args.log)
+    config = dict()
+    if args.config_file is not None:
+        config = yaml.safe_load(args.config_file) or dict()
+    if not args.synthetic and args.charts_dir is None and 'charts_dir' not in config:
+        parser.error('Give --charts-dir or a configuration with charts_dir')
+
+    app = QApplication(sys.argv)
+    temp_dir = None
+    if args.synthetic:
+        temp_dir = tempfile.mkdtemp(prefix='avmap-replay-')
+        synthetic_charts.make_chart_set(temp_dir)
+        args.charts_dir = temp_dir
+        args.log = os.path.join(temp_dir, 'flight.fixlog')
+        # Eastbound from the middle of Alpha into Beta
+        synthetic_flight(args.log, -99.0, 38.0, 90.0, 150.0, 120.0)
+    if args.charts_dir is not None:
+        config['charts_dir'] = args.charts_dir
+    try:
+        keys,records = read_fix_log(args.log)
+        pyavmap.configure_charts(config['charts_dir'])
+
+        db = StandInDb()
+        avmap = InstrumentedAvMap(config, args.stall_ms)
+        avmap.resize(args.width, args.height)
+        avmap.show()
+        # Wired like pyAvMap.py, with each position update timestamped first
+        for key,value in [(r[1], r[2]) for r in records if r[0] <= 0]:
+            db.get_item(key).value = value
+        track = db.get_item("TRACK")
+        gs = db.get_item("GS")
+        lat = db.get_item("LAT")
+        lon = db.get_item("LONG")
+        avmap.setGroundSpeed(gs.value)
+        avmap.setPosition(lat.value, lon.value, track.value)
+        lat.valueChanged[float].connect(lambda value: avmap.fix_update())
+        lon.valueChanged[float].connect(lambda value: avmap.fix_update())
+        lat.valueChanged[float].connect(avmap.setLat)
+        lon.valueChanged[float].connect(avmap.setLon)
+        track.valueChanged[float].connect(avmap.setTrack)
+        gs.valueChanged[float].connect(avmap.setGroundSpeed)
+        app.processEvents()
+
+        replayer = Replayer([r for r in records if r[0] > 0], db, args.speed)
+        start = time.perf_counter()
+        replayer.start()
+        app.exec_()
+        elapsed = time.perf_counter() - start
+        avmap.render_worker.stop()
+        if avmap.prefetcher is not None:
+            avmap.prefetcher.stop()
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+    report(args, records, elapsed, avmap)
+
+def report(args, records, elapsed, avmap):
+    results = {'records': len(records),
+               'replay_seconds': elapsed,
+               'speed': args.speed,
+               'position_updates': avmap.updates,
+               'positions_applied': avmap.positions,
+               'updates_merged': avmap.updates - avmap.positions,
+               'updates_subpixel': avmap.unmoved,
+               'updates_painted': len(avmap.latencies),
+               'frames_painted': avmap.paints,
+               'stalls': avmap.stalls,
+               'latency_ms_p50': percentile(avmap.latencies, 50),
+               'latency_ms_p99': percentile(avmap.latencies, 99),
+               'latency_ms_max': max(avmap.latencies) if avmap.latencies else 0.0,
+               'refreshes': len(avmap.refreshes),
+               'render_frames_dropped': avmap.render_worker.dropped,
+               'refresh_ms_p50': percentile(avmap.refreshes, 50),
+               'refresh_ms_p99': percentile(avmap.refreshes, 99),
+               'refresh_ms_max': max(avmap.refreshes) if avmap.refreshes else 0.0}
+    for k,v in results.items():
+        if isinstance(v, float):
+            print ("%-24s %10.2f"%(k, v))
+        else:
+            print ("%-24s %10d"%(k, v))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Recorded FIX value changes, and an in-process stand-in for the FIX
+# database of pyavtools.fix to replay them into.
+#
+# A log file is LOG_MAGIC, one line of JSON naming the recorded keys, then
+# fixed size records of (seconds since the start, key index, value).
+
+import json
+import math
+import time
+import struct
+
+try:
+    from PyQt5.QtCore import *
+except:
+    from PyQt4.QtCore import *
+
+LOG_MAGIC = b'FIXLOG1\n'
+RECORD = struct.Struct('<dBd')
+KEYS = ['LAT', 'LONG', 'TRACK', 'GS']
+
+class FixLogWriter:
+    def __init__(self, fname, keys=KEYS):
+        self.keys = list(keys)
+        self.f = open(fname, 'wb')
+        self.f.write(LOG_MAGIC)
+        self.f.write(json.dumps({'keys': self.keys}).encode('utf-8') + b'\n')
+        self.start = None
+        self.count = 0
+
+    def write(self, key, value, t=None):
+        if t is None:
+            now = time.time()
+            if self.start is None:
+                self.start = now
+            t = now - self.start
+        self.f.write(RECORD.pack(t, self.keys.index(key), value))
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+
+# Returns the recorded keys and a list of (seconds, key, value)
+def read_fix_log(fname):
+    with open(fname, 'rb') as f:
+        if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise RuntimeError ("%s: Not a FIX log"%fname)
+        keys = json.loads(f.readline().decode('utf-8'))['keys']
+        data = f.read()
+    records = list()
+    for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+        t,index,value = RECORD.unpack_from(data, offset)
+        records.append((t, keys[index], value))
+    return keys,records
+
+# Writes a straight, level flight: fixes at rate per second for the given
+# number of seconds, starting at lon,lat on track (degrees) at gs (knots)
+def synthetic_flight(fname, lon, lat, track, gs, seconds, rate=10.0):
+    writer = FixLogWriter(fname)
+    dlat = gs / 3600.0 / 60.0 * math.cos(track * math.pi / 180) / rate
+    dlon = gs / 3600.0 / 60.0 * math.sin(track * math.pi / 180) / rate / math.cos(lat * math.pi / 180)
+    writer.write('TRACK', track, 0.0)
+    writer.write('GS', gs, 0.0)
+    for i in range(int(seconds * rate)):
+        t = i / rate
+        writer.write('LAT', lat + dlat * i, t)
+        writer.write('LONG', lon + dlon * i, t)
+    writer.close()
+
+# Looks like a pyavtools.fix database item to pyAvMap: a value and a
+# valueChanged[float] signal
+class StandInItem(QObject):
+    valueChanged = pyqtSignal([float])
+
+    def __init__(self, key, value=0.0):
+        super(StandInItem, self).__init__()
+        self.key = key
+        self._value = value
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if value != self._value:
+            self._value = value
+            self.valueChanged[float].emit(value)
+
+class StandInDb:
+    def __init__(self):
+        self.items = dict()
+
+    def get_item(self, key):
+        if key not in self.items:
+            self.items[key] = StandInItem(key)
+        return self.items[key]
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Writes charts that look to pyAvMap like tiled FAA charts: Lambert
+# Conformal Conic .htm metadata, a world file and tiles, in either tile
+# layout or as a chart pack. Tiles are drawn one at a time, so large charts
+# never need a whole chart image in memory.
+
+import sys, os
+import io
+import json
+import argparse
+
+from PIL import Image, ImageDraw
+from pyproj import Proj
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TILE_LAYOUT_LEGACY = 1
+TILE_LAYOUT_LEVELS = 2
+GRID_SPACING = 64           # chart pixels between drawn grid lines
+
+HTM_TEMPLATE = """<html><body><pre>
+<Map_Projection_Name>Lambert Conformal Conic</Map_Projection_Name>
+<Standard_Parallel>%g</Standard_Parallel>
+<Standard_Parallel>%g</Standard_Parallel>
+<Longitude_of_Central_Meridian>%g</Longitude_of_Central_Meridian>
+<Latitude_of_Projection_Origin>%g</Latitude_of_Projection_Origin>
+<Column_Count>%d</Column_Count>
+<West_Bounding_Coordinate>%g</West_Bounding_Coordinate>
+<East_Bounding_Coordinate>%g</East_Bounding_Coordinate>
+<North_Bounding_Coordinate>%g</North_Bounding_Coordinate>
+<South_Bounding_Coordinate>%g</South_Bounding_Coordinate>
+</pre></body></html>
+"""
+
+# The .htm text and world file text of a chart covering the given bounds
+# with a width x height source image
+def chart_metadata(llon, rlon, llat, ulat, width, height):
+    lat_1 = llat + (ulat - llat) / 6.0
+    lat_2 = ulat - (ulat - llat) / 6.0
+    lat_0 = (llat + ulat) / 2.0
+    lon_0 = (llon + rlon) / 2.0
+    p = Proj(proj='lcc', lat_0=lat_0, lon_0=lon_0, lat_1=lat_1, lat_2=lat_2,
+             datum='WGS84', units='m')
+    xs,ys = zip(*[p(lon, lat) for lon in (llon, lon_0, rlon) for lat in (llat, ulat)])
+    min_x,max_x,min_y,max_y = min(xs),max(xs),min(ys),max(ys)
+    htm = HTM_TEMPLATE%(lat_1, lat_2, lon_0, lat_0, width, llon, rlon, ulat, llat)
+    world = "%.10f\n0\n0\n%.10f\n%.4f\n%.4f\n"%((max_x - min_x) / width,
+                        -(max_y - min_y) / height, min_x, max_y)
+    return htm,world
+
+# A tile of the (possibly rotated) chart image: the box x0,y0 - x1,y1 in full
+# resolution chart pixels, reduced by factor
+def draw_tile(x0, y0, x1, y1, factor=1, paletted=False):
+    width = (x1 - x0 + factor - 1) // factor
+    height = (y1 - y0 + factor - 1) // factor
+    image = Image.new('RGB', (width, height), (238, 232, 214))
+    draw = ImageDraw.Draw(image)
+    for x in range(x0 - x0 % GRID_SPACING, x1, GRID_SPACING):
+        color = (40, 40, 160) if (x // GRID_SPACING) % 8 == 0 else (150, 170, 200)
+        draw.line([((x - x0) // factor, 0), ((x - x0) // factor, height)], fill=color)
+    for y in range(y0 - y0 % GRID_SPACING, y1, GRID_SPACING):
+        color = (160, 40, 40) if (y // GRID_SPACING) % 8 == 0 else (200, 170, 150)
+        draw.line([(0, (y - y0) // factor), (width, (y - y0) // factor)], fill=color)
+    draw.text((4, 4), "%d,%d"%(x0, y0), fill=(0, 0, 0))
+    if paletted:
+        image = image.quantize(16)
+    return image
+
+def png_bytes(image):
+    buf = io.BytesIO()
+    image.save(buf, 'PNG')
+    return buf.getvalue()
+
+# Writes a chart to directory/<chart_type>/<name>/<name>.*. width and height
+# are the size of the source image, before any rotation. Returns the base name.
+def make_chart(directory, chart_type, name, llon, rlon, llat, ulat, width, height,
+               rotated=False, layout=TILE_LAYOUT_LEVELS, tile_size=512, levels=2,
+               grid=10, paletted=False, pack=False):
+    chart_dir = os.path.join(directory, chart_type, name)
+    os.makedirs(chart_dir, exist_ok=True)
+    base_name = os.path.join(chart_dir, name)
+    htm,world = chart_metadata(llon, rlon, llat, ulat, width, height)
+    if rotated:
+        out_width,out_height = height,width
+    else:
+        out_width,out_height = width,height
+
+    writer = None
+    if pack:
+        from pyavmap.chart_pack import PackWriter, PACK_EXT
+        layout = TILE_LAYOUT_LEVELS
+    else:
+        with open(base_name + '.htm', 'w') as f:
+            f.write(htm)
+        with open(base_name + '.tfw', 'w') as f:
+            f.write(world)
+        if rotated:
+            open(os.path.join(chart_dir, 'rotated'), 'w').close()
+
+    if layout == TILE_LAYOUT_LEGACY:
+        # Single digit tile addresses limit the legacy layout to 10x10
+        grid = min(grid, 10)
+        cut_width = (out_width + grid - 1) // grid
+        cut_height = (out_height + grid - 1) // grid
+        for level in range(levels + 1):
+            for x in range(grid):
+                for y in range(grid):
+                    tile = draw_tile(x*cut_width, y*cut_height, (x+1)*cut_width, (y+1)*cut_height,
+                                     1 << level, paletted)
+                    if level == 0:
+                        fname = base_name + "%d%d.png"%(x, y)
+                    else:
+                        fname = base_name + "-%d-%d%d.png"%(level, x, y)
+                    tile.save(fname)
+        return base_name
+
+    grids = list()
+    tile_dir = os.path.join(chart_dir, 'tiles')
+    for level in range(levels + 1):
+        span = tile_size << level
+        columns = (out_width + span - 1) // span
+        rows = (out_height + span - 1) // span
+        grids.append([columns, rows])
+    layout_info = {'version': TILE_LAYOUT_LEVELS, 'tile_size': tile_size,
+                   'width': out_width, 'height': out_height, 'levels': grids}
+    if pack:
+        writer = PackWriter(base_name + PACK_EXT, {'htm': htm, 'world': world,
+                                    'rotated': rotated, 'layout': layout_info})
+    for level,(columns,rows) in enumerate(grids):
+        span = tile_size << level
+        for x in range(columns):
+            if writer is None:
+                os.makedirs(os.path.join(tile_dir, str(level), str(x)), exist_ok=True)
+            for y in range(rows):
+                tile = draw_tile(x*span, y*span, min((x+1)*span, out_width),
+                                 min((y+1)*span, out_height), 1 << level, paletted)
+                if writer is not None:
+                    writer.add(level, x, y, png_bytes(tile))
+                else:
+                    tile.save(os.path.join(tile_dir, str(level), str(x), "%d.png"%y))
+    if writer is not None:
+        writer.close()
+    else:
+        with open(os.path.join(tile_dir, 'layout.json'), 'w') as f:
+            json.dump(layout_info, f)
+    return base_name
+
+# A small set of charts for benchmarks: two overlapping sectionals side by
+# side and a rotated IFR chart over both
+def make_chart_set(directory, width=4000, height=3000, **kwargs):
+    make_chart(directory, 'Sectional', 'Alpha', -104, -96, 36, 40, width, height, **kwargs)
+    make_chart(directory, 'Sectional', 'Beta', -97, -89, 36, 40, width, height, **kwargs)
+    make_chart(directory, 'IFR', 'L1', -104, -94, 35, 41, width, height, rotated=True, **kwargs)
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic charts for pyAvMap')
+    parser.add_argument('charts_dir', help='Charts directory to write the charts into')
+    parser.add_argument('--width', type=int, default=4000, help='Source image width of each chart')
+    parser.add_argument('--height', type=int, default=3000, help='Source image height of each chart')
+    parser.add_argument('--layout', type=int, default=TILE_LAYOUT_LEVELS,
+                        choices=[TILE_LAYOUT_LEGACY, TILE_LAYOUT_LEVELS])
+    parser.add_argument('--tile-size', type=int, default=512)
+    parser.add_argument('--levels', type=int, default=2)
+    parser.add_argument('--grid', type=int, default=10, help='Tiles across and down (layout 1)')
+    parser.add_argument('--paletted', action='store_true', help='Write 8 bit paletted tiles')
+    parser.add_argument('--pack', action='store_true', help='Write chart packs')
+    args = parser.parse_args()
+    make_chart_set(args.charts_dir, args.width, args.height, layout=args.layout,
+                   tile_size=args.tile_size, levels=args.levels, grid=args.grid,
+                   paletted=args.paletted, pack=args.pack)
+
+if __name__ == "__main__":
+    main()
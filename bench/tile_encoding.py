@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Compares the chart pack tile encodings: packs one chart with each, then
+# measures the pack size, the time to open the chart and draw the first
+# frame, and the time to draw frames along a path across the chart with
+# the tile cache cleared before each one, so every tile is decoded.
+
+import sys, os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from PyQt5.QtGui import *
+except:
+    from PyQt4.QtGui import *
+
+import pyavmap.avchart_proj as proj
+from pyavmap.tile_cache import tiles
+from pyavmap.chart_pack import PACK_EXT, TILE_ENCODINGS
+
+MAKE_TILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'make_tiles', 'make_tiles.py')
+
+def pack_chart(args, encoding, work_dir):
+    name = os.path.basename(args.base_name)
+    chart_dir = os.path.join(work_dir, encoding)
+    os.makedirs(chart_dir)
+    for ext in ('.tif', '.htm', '_tif.htm', '.tfw', '.tfwx'):
+        if os.path.exists(args.base_name + ext):
+            os.symlink(os.path.abspath(args.base_name + ext), os.path.join(chart_dir, name + ext))
+    command = [sys.executable, MAKE_TILES, name, '--pack', '--encoding', encoding,
+               '--tile-size', str(args.tile_size), '--levels', str(args.levels)]
+    if args.rotate:
+        command.insert(3, '1')
+    subprocess.check_call(command, cwd=chart_dir, stdout=subprocess.DEVNULL)
+    return os.path.join(chart_dir, name)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+def measure(args, base_name):
+    tiles.clear()
+    start = time.perf_counter()
+    chart = proj.AvChart(os.path.basename(base_name), base_name, args.rotate)
+    opened = time.perf_counter()
+    lon = (chart.llon + chart.rlon) / 2.0
+    lat = (chart.ulat + chart.llat) / 2.0
+    chart.construct_image(lon, lat, args.width, args.height, args.zoom)
+    first_frame = time.perf_counter()
+
+    frames = list()
+    for i in range(args.frames):
+        f = (i + 0.5) / args.frames
+        flon = chart.llon + (chart.rlon - chart.llon) * (0.25 + f * 0.5)
+        flat = chart.llat + (chart.ulat - chart.llat) * (0.25 + f * 0.5)
+        tiles.clear()
+        start_frame = time.perf_counter()
+        chart.construct_image(flon, flat, args.width, args.height, args.zoom)
+        frames.append((time.perf_counter() - start_frame) * 1000.0)
+    return {'pack_bytes': os.path.getsize(base_name + PACK_EXT),
+            'open_ms': (opened - start) * 1000.0,
+            'first_frame_ms': (first_frame - opened) * 1000.0,
+            'refresh_ms_mean': sum(frames) / len(frames),
+            'refresh_ms_p50': percentile(frames, 50),
+            'refresh_ms_p99': percentile(frames, 99)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare chart pack tile encodings')
+    parser.add_argument('base_name', help='Chart file name without the .tif extension')
+    parser.add_argument('--rotate', action='store_true', help='Rotate the chart 90 degrees')
+    parser.add_argument('--encodings', nargs='+', default=TILE_ENCODINGS, choices=TILE_ENCODINGS)
+    parser.add_argument('--tile-size', type=int, default=512)
+    parser.add_argument('--levels', type=int, default=2)
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=600)
+    parser.add_argument('--zoom', type=float, default=1.0)
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    app = QGuiApplication(sys.argv)
+    work_dir = tempfile.mkdtemp(prefix='avmap-bench-')
+    results = dict()
+    try:
+        for encoding in args.encodings:
+            base_name = pack_chart(args, encoding, work_dir)
+            results[encoding] = measure(args, base_name)
+    finally:
+        shutil.rmtree(work_dir)
+
+    print ("%-8s %10s %9s %12s %10s %10s %10s"%('encoding', 'pack MB', 'open ms',
+                'first ms', 'mean ms', 'p50 ms', 'p99 ms'))
+    for encoding,r in results.items():
+        print ("%-8s %10.2f %9.1f %12.1f %10.1f %10.1f %10.1f"%(encoding,
+                r['pack_bytes'] / 1e6, r['open_ms'], r['first_frame_ms'],
+                r['refresh_ms_mean'], r['refresh_ms_p50'], r['refresh_ms_p99']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
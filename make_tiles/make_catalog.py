@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import sys, os, time
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pyavmap.catalog as catalog
+
+parser = argparse.ArgumentParser(description='Build the chart catalog pyAvMap reads at startup')
+parser.add_argument('charts_dir', help='The charts directory, as given by charts_dir in the configuration')
+parser.add_argument('--output', '-o', default=None,
+                    help='Catalog file to write (default <charts_dir>/%s)'%catalog.CATALOG_FILE)
+parser.add_argument('--verbose', '-v', action='store_true', help='Run in verbose mode')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+start = time.time()
+count = catalog.build_catalog(args.charts_dir, args.output)
+print ("Cataloged %d charts in %.1f seconds"%(count, time.time() - start))
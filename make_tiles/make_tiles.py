@@ -16,31 +16,293 @@
 #  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
 import sys, os
+import io
+import json
+import time
+import argparse
+import multiprocessing
 from PIL import Image
 
-Image.MAX_IMAGE_PIXELS=225000000
-print ("Reading Image...")
-i=Image.open(sys.argv[1] + '.tif')
-if len(sys.argv) > 2:
-    rotate = bool(sys.argv[2])
-else:
-    rotate = False
-ncuts = 10
-cut_width = int(round(float(i.width) / float(ncuts)))
-cut_height = int(round(float(i.height) / float(ncuts)))
-xoff = 0
-for x in range(ncuts):
-    yoff = 0
-    for y in range(ncuts):
-        print ("Cropping tile %dx%d..."%(x,y))
-        ci = i.crop((xoff,yoff,xoff+cut_width,yoff+cut_height))
-        if rotate:
-            ci = ci.transpose (Image.ROTATE_90)
-            ci.save(sys.argv[1] + str(y) + str(ncuts-x-1) + ".png")
+try:
+    import numpy
+except:
+    numpy = None
+
+# rasterio reads windows of the GeoTIFF without loading the whole image.
+# Without it, the image is loaded once and shared with the worker processes.
+try:
+    import rasterio
+    from rasterio.windows import Window
+except:
+    rasterio = None
+
+# Layout 1 is the original 10x10 grid of <base><x><y>.png files. Layout 2
+# keeps fixed size square tiles in tiles/<level>/<x>/<y>.png, described by
+# tiles/layout.json, and has no limit on the number of tiles.
+TILE_LAYOUT_LEGACY = 1
+TILE_LAYOUT_LEVELS = 2
+
+# Tile encodings of a chart pack. The raw encodings are Qt image formats
+# (RGB16 and ARGB32_Premultiplied) that pyAvMap draws without decoding.
+TILE_PNG = 'png'
+TILE_RGB16 = 'rgb16'
+TILE_ARGB32 = 'argb32'
+
+class PilSource:
+    shareable = True
+    def __init__(self, fname):
+        Image.MAX_IMAGE_PIXELS = None
+        self.image = Image.open(fname)
+        self.image.load()
+        self.width,self.height = self.image.size
+
+    def read(self, box):
+        return self.image.crop(box)
+
+class RasterioSource:
+    shareable = False
+    def __init__(self, fname):
+        self.ds = rasterio.open(fname)
+        self.width,self.height = self.ds.width,self.ds.height
+        self.palette = None
+        if self.ds.count == 1:
+            try:
+                cmap = self.ds.colormap(1)
+                self.palette = list()
+                for i in range(256):
+                    self.palette.extend(cmap.get(i, (0,0,0,255))[:3])
+            except ValueError:
+                pass        # No colormap, so it's grayscale
+
+    def read(self, box):
+        x0,y0,x1,y1 = box
+        # Match PIL, which pads a crop running off the image with black
+        boundless = x1 > self.width or y1 > self.height
+        data = self.ds.read(window=Window(x0, y0, x1-x0, y1-y0), boundless=boundless, fill_value=0)
+        if self.ds.count == 1:
+            ci = Image.fromarray(data[0])
+            if self.palette is not None:
+                ci.putpalette(self.palette)
+            return ci
+        return Image.fromarray(numpy.ascontiguousarray(numpy.moveaxis(data[:3], 0, -1)))
+
+def open_source(fname):
+    if rasterio is not None:
+        return RasterioSource(fname)
+    return PilSource(fname)
+
+# The source image and pack tile encoding of each worker process
+source = None
+encoding = TILE_PNG
+
+def init_worker(fname, tile_encoding):
+    global source, encoding
+    encoding = tile_encoding
+    if source is None or not source.shareable:
+        source = open_source(fname)
+
+# Paletted charts stay paletted at every pyramid level, mapped back to the
+# chart's own palette, so pyAvMap can keep their tiles at 8 bits per pixel
+def reduce_tile(ci, factor):
+    if factor == 1:
+        return ci
+    if ci.mode == 'P':
+        return ci.convert('RGB').reduce(factor).quantize(palette=ci, dither=Image.NONE)
+    return ci.reduce(factor)
+
+# Tile image as stored in a chart pack. Raw pixels are native endian with
+# rows padded to a multiple of 4 bytes, as QImage expects.
+def encode_tile(tile, encoding):
+    if encoding == TILE_PNG:
+        buf = io.BytesIO()
+        tile.save(buf, 'PNG')
+        return buf.getvalue()
+    rgb = numpy.asarray(tile.convert('RGB'), dtype=numpy.uint32)
+    r,g,b = rgb[:,:,0],rgb[:,:,1],rgb[:,:,2]
+    if encoding == TILE_ARGB32:
+        # Charts are opaque, so premultiplying changes nothing
+        return (0xff000000 | (r << 16) | (g << 8) | b).astype(numpy.uint32).tobytes()
+    pixels = ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+    pixels = pixels.astype(numpy.uint16)
+    if pixels.shape[1] % 2:
+        pixels = numpy.pad(pixels, ((0,0),(0,1)))
+    return pixels.tobytes()
+
+# A job is a source box, whether to rotate it, and a list of
+# (reduction factor, destination) outputs made from it. The destination is
+# a file name, or a (level, x, y) tile address when writing a chart pack.
+def make_tile(job):
+    box,rotate,outputs = job
+    ci = source.read(box)
+    if rotate:
+        ci = ci.transpose (Image.ROTATE_90)
+    packed = list()
+    for factor,dest in outputs:
+        tile = reduce_tile(ci, factor)
+        if isinstance(dest, tuple):
+            # Packed tiles go back to the main process to be written
+            packed.append((dest, encode_tile(tile, encoding)))
         else:
-            ci.save(sys.argv[1] + str(x) + str(y) + ".png")
-        yoff += cut_height
-    xoff += cut_width
-if rotate:
-    f = open ('rotated', 'w')
-    f.close()
+            tile.save(dest)
+    return (box[2]-box[0]) * (box[3]-box[1]), len(outputs), packed
+
+# Level 0 is full resolution; each level above it is half the size of the one below
+def tile_name(base_name, x, y, level):
+    if level == 0:
+        return base_name + str(x) + str(y) + ".png"
+    return base_name + '-' + str(level) + '-' + str(x) + str(y) + ".png"
+
+def legacy_jobs(args, width, height, rotate):
+    ncuts = 10
+    cut_width = int(round(float(width) / float(ncuts)))
+    cut_height = int(round(float(height) / float(ncuts)))
+    jobs = list()
+    for x in range(ncuts):
+        for y in range(ncuts):
+            box = (x*cut_width, y*cut_height, (x+1)*cut_width, (y+1)*cut_height)
+            if rotate:
+                tx,ty = y,ncuts-x-1
+            else:
+                tx,ty = x,y
+            outputs = [(1 << level, tile_name(args.base_name, tx, ty, level))
+                        for level in range(args.levels+1)]
+            jobs.append((box, rotate, outputs))
+    return jobs
+
+# Source image box for a box of the (possibly rotated) output chart
+def source_box(source_width, rotate, x0, y0, x1, y1):
+    if rotate:
+        # Rotating 90 degrees counter clockwise puts source column
+        # width-1-y at output row y
+        return (source_width - y1, x0, source_width - y0, x1)
+    return (x0, y0, x1, y1)
+
+def level_jobs(args, source_width, source_height, rotate):
+    tile_dir = os.path.join(os.path.dirname(args.base_name), 'tiles')
+    size = args.tile_size
+    if rotate:
+        width,height = source_height,source_width
+    else:
+        width,height = source_width,source_height
+    grids = list()
+    jobs = list()
+    for level in range(args.levels+1):
+        span = size << level        # full resolution pixels covered by one tile
+        columns = (width + span - 1) // span
+        rows = (height + span - 1) // span
+        grids.append([columns, rows])
+        for x in range(columns):
+            if not args.pack:
+                os.makedirs(os.path.join(tile_dir, str(level), str(x)), exist_ok=True)
+            for y in range(rows):
+                x0 = x * span
+                y0 = y * span
+                box = source_box(source_width, rotate, x0, y0,
+                                 min(x0+span, width), min(y0+span, height))
+                if args.pack:
+                    dest = (level, x, y)
+                else:
+                    dest = os.path.join(tile_dir, str(level), str(x), str(y) + ".png")
+                jobs.append((box, rotate, [(1 << level, dest)]))
+    layout = {'version': TILE_LAYOUT_LEVELS, 'tile_size': size,
+              'width': width, 'height': height, 'levels': grids}
+    return jobs,layout,tile_dir
+
+def read_text(*names):
+    for name in names:
+        if os.path.exists(name):
+            with open(name, 'r') as f:
+                return f.read()
+    raise RuntimeError("None of %s found"%str(names))
+
+# A chart pack carries the chart metadata with the tiles, so the chart
+# directory needs nothing else
+def open_pack(base_name, rotate, layout, encoding):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from pyavmap.chart_pack import PackWriter, PACK_EXT
+    metadata = {'htm': read_text(base_name + '.htm', base_name + '_tif.htm'),
+                'world': read_text(base_name + '.tfw', base_name + '.tfwx'),
+                'rotated': rotate,
+                'layout': layout,
+                'encoding': encoding}
+    return PackWriter(base_name + PACK_EXT, metadata)
+
+def main():
+    global source
+    parser = argparse.ArgumentParser(description='Cut a chart image into tiles for pyAvMap')
+    parser.add_argument('base_name', help='Chart file name without the .tif extension')
+    parser.add_argument('rotate', nargs='?', default='',
+                        help='Any non-empty value rotates the chart 90 degrees')
+    parser.add_argument('--levels', type=int, default=2,
+                        help='Number of downsampled pyramid levels to write in addition to full resolution')
+    parser.add_argument('--layout', type=int, default=TILE_LAYOUT_LEVELS,
+                        choices=[TILE_LAYOUT_LEGACY, TILE_LAYOUT_LEVELS],
+                        help='Tile layout version to write')
+    parser.add_argument('--tile-size', type=int, default=512,
+                        help='Width and height of each tile in pixels (layout 2 only)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='Number of tiles to encode in parallel')
+    parser.add_argument('--pack', action='store_true',
+                        help='Write the chart and its tiles to a single <base_name>.avc file (layout 2 only)')
+    parser.add_argument('--encoding', default=TILE_PNG, choices=[TILE_PNG, TILE_RGB16, TILE_ARGB32],
+                        help='Tile encoding of a chart pack. The raw encodings are larger '
+                             'but are drawn without decoding.')
+    args = parser.parse_args()
+    if args.pack and args.layout != TILE_LAYOUT_LEVELS:
+        parser.error('--pack requires --layout %d'%TILE_LAYOUT_LEVELS)
+    if args.encoding != TILE_PNG:
+        if not args.pack:
+            parser.error('--encoding %s requires --pack'%args.encoding)
+        if numpy is None:
+            parser.error('--encoding %s requires numpy'%args.encoding)
+
+    fname = args.base_name + '.tif'
+    rotate = bool(args.rotate)
+    start = time.time()
+    print ("Reading Image...")
+    source = open_source(fname)
+    print ("%s is %dx%d, read with %s"%(fname, source.width, source.height,
+                                        type(source).__name__))
+    layout = None
+    if args.layout == TILE_LAYOUT_LEGACY:
+        jobs = legacy_jobs(args, source.width, source.height, rotate)
+    else:
+        jobs,layout,tile_dir = level_jobs(args, source.width, source.height, rotate)
+
+    # fork lets the workers share an image that was loaded whole
+    if 'fork' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('fork')
+    else:
+        ctx = multiprocessing.get_context()
+    pack = None
+    if args.pack:
+        pack = open_pack(args.base_name, rotate, layout, args.encoding)
+    pixels = 0
+    tiles = 0
+    encode_start = time.time()
+    with ctx.Pool(max(args.jobs, 1), initializer=init_worker,
+                  initargs=(fname, args.encoding)) as pool:
+        for done,(job_pixels,job_tiles,packed) in enumerate(pool.imap_unordered(make_tile, jobs), 1):
+            pixels += job_pixels
+            tiles += job_tiles
+            for (level,x,y),data in packed:
+                pack.add(level, x, y, data)
+            if done % 50 == 0 or done == len(jobs):
+                elapsed = max(time.time() - encode_start, 1e-6)
+                print ("%d/%d jobs, %d tiles, %.1f tiles/s, %.1f MP/s"%(done, len(jobs), tiles,
+                            tiles / elapsed, pixels / elapsed / 1e6))
+    if pack is not None:
+        pack.close()
+        print ("Packed %d tiles into %s"%(tiles, pack.fname))
+    elif layout is not None:
+        with open(os.path.join(tile_dir, 'layout.json'), 'w') as f:
+            json.dump(layout, f)
+    if rotate and pack is None:
+        f = open ('rotated', 'w')
+        f.close()
+    elapsed = time.time() - start
+    print ("Wrote %d tiles in %.1f seconds (%.1f tiles/s, %.1f source MP/s) with %d workers"%(
+                tiles, elapsed, tiles / elapsed, pixels / elapsed / 1e6, args.jobs))
+
+if __name__ == "__main__":
+    main()
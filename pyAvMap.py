@@ -139,14 +139,15 @@ if __name__ == "__main__":
 
     main_window.show()
     track = fix.db.get_item("TRACK")
-    avmap.setTrack(track.value)
+    gs = fix.db.get_item("GS")
+    avmap.setGroundSpeed(gs.value)
     lat = fix.db.get_item("LAT")
-    avmap.setLat(lat.value)
     lon = fix.db.get_item("LONG")
-    avmap.setLon (lon.value)
+    avmap.setPosition (lat.value, lon.value, track.value)
     lat.valueChanged[float].connect(avmap.setLat)
     lon.valueChanged[float].connect(avmap.setLon)
     track.valueChanged[float].connect(avmap.setTrack)
+    gs.valueChanged[float].connect(avmap.setGroundSpeed)
 
     # Main program loop
     result = app.exec_()
@@ -17,9 +17,7 @@
 import math
 import logging
 import time
-import threading
 import os
-from glob import glob
 
 try:
     from PyQt5.QtGui import *
@@ -30,36 +28,26 @@ except:
     from PyQt4.QtCore import *
 
 import pyavmap.avchart_proj as proj
+import pyavmap.tile_cache as tile_cache
+import pyavmap.catalog as catalog
+from pyavmap.render_worker import RenderWorker, RenderRequest
+from pyavmap.prefetch import Prefetcher
+from pyavmap.track import TrackHistory
+import pyavmap.overlay as overlay
 
 log = logging.getLogger(__name__)
 
+# Points recorded since the path was last simplified before it is simplified again
+PATH_RESIMPLIFY = 100
+# Longest a lone LAT or LONG update waits for the other half of its fix. FIX
+# only sends values that changed, so the other half may never come.
+POSITION_PAIR_WAIT = 0.05
+
 class AvMap(QGraphicsView):
-    icon_poly_points = [
-        QPointF (0,0)
-       ,QPointF (5,5)
-       ,QPointF (20,5)
-
-       ,QPointF (30,25)
-       ,QPointF (40,25)
-       ,QPointF (35,5)
-
-       ,QPointF (50,5)
-       ,QPointF (55,10)
-       ,QPointF (65,10)
-       ,QPointF (60,0)
-       ,QPointF (65,-10)
-       ,QPointF (55,-10)
-       ,QPointF (50,-5)
-
-       ,QPointF (35,-5)
-       ,QPointF (40,-25)
-       ,QPointF (30,-25)
-
-       ,QPointF (20,-5)
-       ,QPointF (5,-5)
-    ]
-    icon_center = QPointF(25,0)
+    icon_poly_points = overlay.ICON_POLY_POINTS
+    icon_center = overlay.ICON_CENTER
     scene_size_multiplier=4
+    frameReady = pyqtSignal(object)
     def __init__(self, config, parent=None):
         super(AvMap, self).__init__(parent)
         self.config = config
@@ -73,6 +61,7 @@ class AvMap(QGraphicsView):
         self._lat = 0
         self._lon = 0
         self._track_direction = 0
+        self._ground_speed = 0
 
         self.chart_type = proj.CT_SECTIONAL if 'chart_type' not in self.config else self.config ['chart_type']
 
@@ -89,17 +78,30 @@ class AvMap(QGraphicsView):
                             else self.config['icon_outline']
         self.show_path = False if 'show_path' not in self.config else self.config['show_path']
         self.path_color = Qt.green if 'path_color' not in self.config else self.config['path_color']
-        self.path_history = list()
         self.last_path_time = 0
-        self.max_path_len = 1000 if 'path_length' not in self.config else self.config['path_length']
+        # At most one point a second, so the default is 10 hours of track
+        self.max_path_len = 36000 if 'path_length' not in self.config else self.config['path_length']
+        self.path_history = TrackHistory(self.max_path_len)
+        # The drawn path leaves out points closer than this many pixels to it
+        self.path_tolerance = 1.0 if 'path_tolerance' not in self.config \
+                                    else self.config['path_tolerance']
+        # path_history projected into zoomed chart pixels for path_chart at
+        # path_zoom, and simplified. Points are projected once as they are
+        # recorded; all of them are projected and simplified again when the
+        # chart or zoom changes, or PATH_RESIMPLIFY points have been added.
+        self.path_polygon = QPolygonF()
+        self.path_chart = None
+        self.path_zoom = None
+        self.path_appended = 0
         self.north_is_up = True if 'north_is_up' not in self.config else self.config['north_is_up']
         self.extended_track_length = 100 if 'extended_track_length' not in self.config \
                                     else self.config['extended_track_length']
         self.el_color = Qt.yellow if 'el_color' not in self.config else self.config['el_color']
+        self.incremental_refresh = True if 'incremental_refresh' not in self.config \
+                                    else self.config['incremental_refresh']
         self.last_rotation_val = 0.0
         self.chart = None
         self.map_pixmap = None
-        self.new_map_pixmap = None
         self.map_pixmap_lon = None
         self.map_pixmap_lat = None
         self.pmi = None
@@ -113,15 +115,53 @@ class AvMap(QGraphicsView):
         self.xzoom = None
         self.yzoom = None
         self.chart_image_time = 0
-        self.pxmap_update_pending = False
-        self.pxmap_update = None
-        self.pxmap_lock = threading.RLock()
+        # Background images are built by a single worker thread. Frames from
+        # before the last synchronous rebuild (chart type, zoom or size change)
+        # carry an old generation and are discarded.
+        self.frame_generation = 0
+        self.requested_corner = None
+        self.frameReady.connect(self.accept_frame)
+        self.render_worker = RenderWorker(self.frameReady.emit, self.incremental_refresh)
+        # Tiles along the predicted track are decoded ahead of time
+        prefetch_seconds = 60 if 'prefetch_seconds' not in self.config \
+                                else self.config['prefetch_seconds']
+        prefetch_step = 10 if 'prefetch_step' not in self.config else self.config['prefetch_step']
+        self.prefetcher = None
+        if prefetch_seconds > 0:
+            self.prefetcher = Prefetcher(self.render_worker, prefetch_seconds, prefetch_step)
+        # Position and track updates are merged and applied by one timer, at
+        # most max_frame_rate times a second. 0 applies each one as it comes.
+        self.max_frame_rate = 20 if 'max_frame_rate' not in self.config \
+                                    else self.config['max_frame_rate']
+        # Updates are held at least this long (seconds) from the first one
+        # pending, so LAT and LONG from separate FIX messages land together
+        self.position_coalesce = .02 if 'position_coalesce' not in self.config \
+                                    else self.config['position_coalesce']
+        self.pending_lat = None
+        self.pending_lon = None
+        self.pending_track = None
+        self.pending_since = None
+        self.last_frame_time = 0
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.timeout.connect(self.frame_tick)
+        if 'fast_projection' in self.config:
+            proj.set_fast_projection (self.config['fast_projection'])
+        if 'chart_cache_size' in self.config:
+            proj.set_chart_cache_size (self.config['chart_cache_size'])
+        # Every map shares the process-wide chart and tile caches. The
+        # largest tile_cache_mb of the maps is the budget for all of them.
+        if 'tile_cache_mb' in self.config:
+            tile_cache.tiles.request_budget (id(self), self.config['tile_cache_mb'])
 
     def resizeEvent(self, event):
         log.debug("resizeEvent")
         #Setup the scene that we use for the background of the AI
         self.pxmpHeight = self.height() * self.scene_size_multiplier
         self.pxmpWidth = self.width() * self.scene_size_multiplier
+        # The shown background and the render worker's last frame, held on
+        # top of the shared tile cache budget
+        tile_cache.tiles.reserve (id(self), 2 * self.pxmpWidth * self.pxmpHeight * 4)
         self.scene = QGraphicsScene(0, 0, self.pxmpWidth+self.width(), self.pxmpHeight+self.height())
         self.setScene(self.scene)
         self.init_chart()
@@ -130,29 +170,24 @@ class AvMap(QGraphicsView):
         cd = None if 'charts_dir' not in self.config else self.config['charts_dir']
         candidates = proj.find_charts (self.chart_type, self._lon, self._lat, cd,
                     self.pxmpWidth, self.pxmpHeight, self.zoom)
-        if len(candidates) == 0:
-            return None
-        best_chart = candidates[0]
-        if len(candidates) > 1:
-            best_dir = abs(Heading (((self._lon,self._lat), (candidates[0].center_lat, candidates[0].center_lon))) -
-                            self._track_direction)
-            if best_dir > 180:
-                best_dir -= 180
-            for ch in candidates[1:]:
-                d = abs(Heading (((self._lon,self._lat), (ch.center_lat, ch.center_lon))) - self._track_direction)
-                if d > 180:
-                    d = abs(d-360)
-                if d < best_dir:
-                    best_dir = d
-                    best_chart = ch
-        return best_chart
+        return best_chart (candidates, self._lon, self._lat, self._track_direction)
+
+    # Holds a reference on the chart shown, so that it stays shared with any
+    # other map showing it
+    def set_chart(self, chart):
+        if chart is not self.chart:
+            proj.acquire_chart (chart)
+            proj.release_chart (self.chart)
+            self.chart = chart
 
     def init_chart(self):
         log.debug("init_chart")
-        self.chart = self.find_best_chart()
+        self.set_chart (self.find_best_chart())
         if self.chart is None:
             log.error ("No chart found for %g,%g", self._lon, self._lat)
             return
+        self.frame_generation += 1
+        self.requested_corner = None
         self.map_pixmap_lon = self._lon
         self.map_pixmap_lat = self._lat
         try:
@@ -174,15 +209,8 @@ class AvMap(QGraphicsView):
 
     def redraw(self):
         self.resetTransform()
-        self.pxmap_lock.acquire()
-        if self.pxmap_update_pending and (self.new_map_pixmap is not None):
-            self.map_pixmap = self.new_map_pixmap
-            self.pmi.setPixmap (self.map_pixmap)
-            self.new_map_pixmap = None
-            self.pxmap_update_pending = False
         cx = self.xzoom-self.corner_x + self.width()/2
         cy = self.yzoom-self.corner_y + self.height()/2
-        self.pxmap_lock.release()
         log.log (2, "redraw center on %g,%g - %g,%g - %d,%d = %g,%g", self.xzoom, self.yzoom,
                         self.corner_x, self.corner_y,
                         self.width()/2, self.height()/2,
@@ -215,9 +243,15 @@ class AvMap(QGraphicsView):
             cy -= self.yoff
         self.centerOn(cx, cy)
 
-    def setLat(self, val):
-        if val != self._lat and self.isVisible():
-            self._lat = val
+    # Moves the map to a new position, and optionally track, as one update
+    def setPosition(self, lat, lon, track=None):
+        if not self.isVisible():
+            return
+        if track is not None:
+            self._track_direction = track
+        if lat != self._lat or lon != self._lon:
+            self._lat = lat
+            self._lon = lon
             if self.chart is None or self.map_pixmap is None:
                 self.init_chart()
             else:
@@ -226,31 +260,80 @@ class AvMap(QGraphicsView):
                 self.check_pxmap_update()
                 self.record_track()
 
+    def setLat(self, val):
+        if self.max_frame_rate > 0:
+            self.pending_lat = val
+            self.schedule_frame()
+        else:
+            self.setPosition (val, self._lon)
+
     def setLon(self, val):
-        if val != self._lon and self.isVisible():
-            self._lon = val
-            if self.chart is None or self.map_pixmap is None:
-                self.init_chart()
-            else:
-                self.xzoom,self.yzoom = self.chart.get_zoom_pos (self._lon, self._lat, self.zoom)
-                self.redraw()
-                self.check_pxmap_update()
-                self.record_track()
+        if self.max_frame_rate > 0:
+            self.pending_lon = val
+            self.schedule_frame()
+        else:
+            self.setPosition (self._lat, val)
+
+    def schedule_frame(self):
+        if not self.frame_timer.isActive():
+            now = time.time()
+            if self.pending_since is None:
+                self.pending_since = now
+            wait = max(self.last_frame_time + 1.0 / self.max_frame_rate - now,
+                       self.pending_since + self.position_coalesce - now)
+            self.frame_timer.start (max(int(math.ceil(wait * 1000)), 0))
+
+    # Applies the updates that arrived since the last tick
+    def frame_tick(self):
+        if (self.pending_lat is None) != (self.pending_lon is None) and \
+                time.time() - self.pending_since < POSITION_PAIR_WAIT:
+            # Half of a position; give the other half a little longer
+            self.frame_timer.start (max(int(math.ceil(self.position_coalesce * 1000)), 1))
+            return
+        lat = self._lat if self.pending_lat is None else self.pending_lat
+        lon = self._lon if self.pending_lon is None else self.pending_lon
+        track = self.pending_track
+        self.pending_lat = None
+        self.pending_lon = None
+        self.pending_track = None
+        self.pending_since = None
+        self.last_frame_time = time.time()
+        self.setPosition (lat, lon, track)
 
     def record_track(self):
         add = False
         now = time.time()
-        if len(self.path_history) > 0:
-            dist = Distance (((self._lon,self._lat), self.path_history[-1]))
+        last = self.path_history.last()
+        if last is not None:
+            dist = Distance (((self._lon,self._lat), last))
             if dist > 10 and now - self.last_path_time > 1:
                 add = True
         else:
             add = True
         if add:
-            self.path_history.append ((self._lon,self._lat))
+            dropped = self.path_history.append (self._lon, self._lat)
             self.last_path_time = now
-            if len(self.path_history) > self.max_path_len:
-                del self.path_history[0]
+            if self.path_chart is not None:
+                x,y = self.path_chart.proj_fast (self._lon, self._lat)
+                self.path_polygon.append (QPointF(x*self.path_zoom, y*self.path_zoom))
+                self.path_appended += 1
+                if dropped:
+                    # The polyline always starts at the oldest point
+                    x,y = self.path_chart.proj (*self.path_history.first())
+                    self.path_polygon.replace (0, QPointF(x*self.path_zoom, y*self.path_zoom))
+
+    # The path history as a polyline in zoomed chart pixels of the current chart
+    def path_polyline(self):
+        if self.path_chart is not self.chart or self.path_zoom != self.zoom or \
+                self.path_appended >= PATH_RESIMPLIFY:
+            self.path_polygon = overlay.path_polygon (self.chart, self.path_history,
+                                    self.zoom, self.path_tolerance)
+            self.path_chart = self.chart
+            self.path_zoom = self.zoom
+            self.path_appended = 0
+            log.debug ("path of %d points drawn with %d on %s at zoom %g", len(self.path_history),
+                        self.path_polygon.size(), self.chart.name, self.zoom)
+        return self.path_polygon
 
     def incZoom(self, diff):
         log.debug("incZoom")
@@ -265,6 +348,8 @@ class AvMap(QGraphicsView):
                 if self.chart is None or self.map_pixmap is None:
                     self.init_chart()
                 else:
+                    self.frame_generation += 1
+                    self.requested_corner = None
                     self.map_pixmap_lon = self._lon
                     self.map_pixmap_lat = self._lat
                     try:
@@ -281,9 +366,20 @@ class AvMap(QGraphicsView):
                         self.redraw()
 
     def setTrack(self, val):
-        if val != self._track_direction and self.isVisible():
+        if not self.isVisible():
+            return
+        if self.max_frame_rate > 0:
+            # A change back to the shown track still replaces a pending one
+            current = self._track_direction if self.pending_track is None else self.pending_track
+            if val != current:
+                self.pending_track = val
+                self.schedule_frame()
+        elif val != self._track_direction:
             self._track_direction = val
 
+    def setGroundSpeed(self, val):
+        self._ground_speed = val
+
     def set_chart_type(self, ct):
         self.chart_type = ct
         self.init_chart()
@@ -299,83 +395,54 @@ class AvMap(QGraphicsView):
         p = QPainter(self.viewport())
         p.setRenderHint(QPainter.Antialiasing)
 
-        p.setPen(QColor(self.icon_outline))
-        p.setBrush(QColor(self.icon_fill))
-        p.setOpacity (self.icon_opacity)
-        ix = self.icon_center.x()*self.icon_scale
-        iy = self.icon_center.y()*self.icon_scale
         if (self.chart is not None) and self.north_is_up:
-            angle = self._track_direction * math.pi/180
-            angle += self.chart.north_angle
+            angle = overlay.icon_angle (self.chart, self._track_direction)
         else:
             angle = math.pi/2
-        cosa = math.cos(angle)
-        sina = math.sin(angle)
-        offset_x = self.width()/2 + self.xoff - (ix*cosa - iy*sina)
-        offset_y = self.height()/2 + self.yoff - (iy*cosa + ix*sina)
-        pp = [QPointF ((p.x()*cosa - p.y()*sina)*self.icon_scale + offset_x,
-                       (p.y()*cosa + p.x()*sina)*self.icon_scale + offset_y)
-              for p in self.icon_poly_points]
-        p.drawPolygon(QPolygonF(pp))
+        bx = w/2 + self.xoff
+        by = h/2 + self.yoff
+        overlay.draw_ownship (p, bx, by, angle, self.icon_scale,
+                              self.icon_fill, self.icon_outline, self.icon_opacity)
 
         if self.north_is_up and self.show_path and len(self.path_history) >= 2:
-            p.setPen(QColor(self.path_color))
-            p.setOpacity(1.0)
             cx = self.xzoom-self.corner_x-self.xoff     # Where in the pixmap is the center of the display
             cy = self.yzoom-self.corner_y-self.yoff
-            cx -= self.width()/2                        # Where in the pixmap is the ul corner of display
-            cy -= self.height()/2
-            last_coord_x,last_coord_y = self.screen_coord (self.path_history[0][0], self.path_history[0][1], cx, cy)
-            for i in range(1,len(self.path_history)):
-                icoord_x,icoord_y = self.screen_coord (self.path_history[i][0], self.path_history[i][1], cx,cy)
-                p.drawLine(QPointF(last_coord_x,last_coord_y), QPointF(icoord_x,icoord_y))
-                log.debug("path_history %.1f,%.1f -> %.1f,%.1f", last_coord_x, last_coord_y, icoord_x, icoord_y)
-                last_coord_x = icoord_x
-                last_coord_y = icoord_y
+            cx -= w/2                                   # Where in the pixmap is the ul corner of display
+            cy -= h/2
+            overlay.draw_path (p, self.path_polyline(), -self.corner_x - cx, -self.corner_y - cy,
+                               self.path_color)
         if self.north_is_up and self.extended_track_length > 0:
-            ix = 0
-            iy = -self.extended_track_length
-            ext_dx = (ix*cosa - iy*sina)
-            ext_dy = (iy*cosa + ix*sina)
-            pen = QPen(QColor(self.el_color))
-            pen.setStyle(Qt.DotLine)
-            p.setPen(pen)
-            bx = self.width()/2 + self.xoff
-            by = self.height()/2 + self.yoff
-            ex = bx + ext_dy
-            ey = by - ext_dx
-            p.drawLine (QPointF(bx,by), QPointF(ex,ey))
-
-    def screen_coord(self, lon, lat, cx, cy):
-            coord_x,coord_y = self.chart.proj (lon,lat)
-            coord_x *= self.zoom
-            coord_y *= self.zoom
-            coord_x -= self.corner_x                    # Where is the track in the pixmap
-            coord_y -= self.corner_y
-            coord_x -= cx
-            coord_y -= cy
-            return coord_x,coord_y
-
-    def update_chart_pixmap(self, chart):
-        try:
-            map_pixmap,corner_x,corner_y,xzoom,yzoom = \
-                    chart.construct_pixmap(self._lon, self._lat,
-                    self.pxmpWidth, self.pxmpHeight, self.zoom)
-            good = True
-        except RuntimeError:
-            good = False
-            self.pxmap_update_pending = False
-            log.error ("update pixmap set failure: %s %g,%g", chart.name, self._lon, self._lat)
-        if good:
-            self.pxmap_lock.acquire()
-            self.new_map_pixmap,self.corner_x,self.corner_y,self.xzoom,self.yzoom = \
-                map_pixmap,corner_x,corner_y,xzoom,yzoom
-            self.chart = chart
-            self.pxmap_lock.release()
-            self.chart_image_time = time.time()
+            overlay.draw_extended_track (p, bx, by, angle, self.extended_track_length, self.el_color)
+
+    # Runs in the GUI thread with a frame finished by the render worker
+    def accept_frame(self, frame):
+        if frame.generation != self.frame_generation or self.pmi is None:
+            log.debug ("discarding stale frame for %s", frame.chart.name)
+            return
+        self.map_pixmap = QPixmap.fromImage(frame.image)
+        self.corner_x = frame.corner_x
+        self.corner_y = frame.corner_y
+        self.set_chart (frame.chart)
+        self.xzoom,self.yzoom = self.chart.get_zoom_pos (self._lon, self._lat, self.zoom)
+        self.pmi.setPixmap (self.map_pixmap)
+        self.redraw()
+
+    # Stops the background threads and gives up this map's share of the
+    # chart and tile caches
+    def shutdown(self):
+        self.frame_timer.stop()
+        self.render_worker.stop()
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+        self.set_chart (None)
+        tile_cache.tiles.release (id(self))
+
+    def closeEvent(self, event):
+        self.shutdown()
+        super(AvMap, self).closeEvent(event)
 
     def check_pxmap_update(self):
-        if (self.chart is not None) and (not self.pxmap_update_pending):
+        if self.chart is not None:
             if time.time() - self.chart_image_time > self.pxmap_update_period:
                 cx,cy,oob = self.chart.compute_ul_corner(self._lon, self._lat,
                             self.pxmpWidth, self.pxmpHeight, self.zoom)
@@ -388,10 +455,34 @@ class AvMap(QGraphicsView):
                     else:
                         log.debug ("Out of bounds. change chart to %s"%chart.name)
                 self.chart_image_time = time.time()
-                if cx != self.corner_x or cy != self.corner_y or chart != self.chart:
-                    self.pxmap_update_pending = True
-                    th = threading.Thread (target=self.update_chart_pixmap, args=(chart,))
-                    th.start()
+                if self.prefetcher is not None:
+                    self.prefetcher.update (chart, self._lon, self._lat, self._track_direction,
+                                self._ground_speed, self.pxmpWidth, self.pxmpHeight, self.zoom)
+                if (cx != self.corner_x or cy != self.corner_y or chart != self.chart) and \
+                        (chart,cx,cy) != self.requested_corner:
+                    log.debug ("tile cache: %s", str(tile_cache.tiles.stats()))
+                    self.requested_corner = (chart,cx,cy)
+                    self.render_worker.submit (RenderRequest(chart, self._lon, self._lat,
+                                self.pxmpWidth, self.pxmpHeight, self.zoom, self.frame_generation))
+
+# Of the charts containing lon,lat, the one whose center is most nearly
+# ahead on the given track
+def best_chart(candidates, lon, lat, track):
+    if len(candidates) == 0:
+        return None
+    best = candidates[0]
+    if len(candidates) > 1:
+        best_dir = abs(Heading (((lon,lat), (candidates[0].center_lat, candidates[0].center_lon))) - track)
+        if best_dir > 180:
+            best_dir -= 180
+        for ch in candidates[1:]:
+            d = abs(Heading (((lon,lat), (ch.center_lat, ch.center_lon))) - track)
+            if d > 180:
+                d = abs(d-360)
+            if d < best_dir:
+                best_dir = d
+                best = ch
+    return best
 
 def get_polar_deltas(course):
     lng1,lat1 = course[0]
@@ -429,27 +520,26 @@ def Heading(course, rel_lng=0):
     return heading
 
 def configure_charts (directory):
-    chart_types = glob(os.path.join (directory, '*'))
-    chart_types = [os.path.basename(ct) for ct in chart_types]
-    log.debug ("Found chart types: %s", str(chart_types))
-    for ct in chart_types:
-        proj.charts[ct] = dict()
-        chart_names = glob(os.path.join (directory, ct, '*'))
-        chart_names = [os.path.basename(cn) for cn in chart_names]
-        log.debug ("Found chart in %s: %s", ct, str(chart_names))
-        for cn in chart_names:
-            base_name = glob(os.path.join (directory, ct, cn, '*.tfw'))
-            if len(base_name) == 0:
-                base_name = glob(os.path.join (directory, ct, cn, '*.tfwx'))
-            if len(base_name) == 0:
-                log.error ("Invalid chart found: %s", os.path.join (directory, ct, cn))
-                continue
-            base = os.path.basename(base_name[0])
-            base = os.path.splitext(base)[0]
-            proj.charts[ct][cn] = [base]
-            if os.path.exists (os.path.join (directory, ct, cn, 'rotated')):
-                proj.charts[ct][cn].append(True)
-            log.debug ("chart %s of type %s is defined: %s", cn, ct, str(proj.charts[ct][cn]))
+    proj.clear_chart_cache()
+    proj.charts.clear()
+    proj.chart_info.clear()
+    proj.chart_index.clear()
+    catalog_name = os.path.join (directory, catalog.CATALOG_FILE)
+    if os.path.exists (catalog_name):
+        try:
+            catalog.load_catalog (catalog_name)
+            return
+        except (RuntimeError, ValueError, KeyError, TypeError, OSError) as e:
+            # An old or damaged catalog; scan the directory as if it weren't there
+            log.warning ("Unable to use chart catalog %s, scanning %s instead: %s "
+                         "(run make_tiles/make_catalog.py to rebuild it)",
+                         catalog_name, directory, str(e))
+            proj.charts.clear()
+            proj.chart_info.clear()
+            proj.chart_index.clear()
+    catalog.scan_charts (directory)
+    for ct in proj.charts.keys():
+        proj.index_charts (ct, directory)
 
 def chart_types():
     return (list(proj.charts.keys()))
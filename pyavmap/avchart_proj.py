@@ -15,17 +15,26 @@
 #  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
 import os, math
+import json
+import threading
+from collections import OrderedDict
 
 try:
     from PyQt5.QtGui import *
     from PyQt5.QtCore import *
     from PyQt5.QtWidgets import *
+    from PyQt5 import sip
 except:
     from PyQt4.QtGui import *
     from PyQt4.QtCore import *
+    import sip
 
+import numpy
 from pyproj import Proj
 
+from pyavmap.tile_cache import tiles
+from pyavmap.chart_pack import ChartPack, PACK_EXT, TILE_PNG, TILE_RGB16, TILE_ARGB32, raw_stride
+
 import logging
 log = logging.getLogger(__name__)
 
@@ -35,106 +44,300 @@ CT_JET = 'Jet'
 CT_TAC = 'Terminal'
 
 charts = dict()
+# Catalog entries of charts, by (chart type, chart name), when the charts
+# were configured from a chart catalog
+chart_info = dict()
+
+# Spatial index of chart extents, by chart type. Each entry maps an
+# (integer lon, integer lat) cell to the ChartExtent objects overlapping it.
+chart_index = dict()
+INDEX_CELL_SIZE = 1.0       # degrees
+NEATLINE_EDGE_POINTS = 16
+
+# Tile layouts written by make_tiles. Layout 1 is the original 10x10 grid
+# of <base><x><y>.png files. Layout 2 keeps fixed size square tiles in
+# tiles/<level>/<x>/<y>.png, described by tiles/layout.json.
+TILE_LAYOUT_LEGACY = 1
+TILE_LAYOUT_LEVELS = 2
+TILE_DIR = 'tiles'
+LAYOUT_FILE = 'layout.json'
+
+# Image formats of the raw chart pack tile encodings
+RAW_FORMATS = {TILE_RGB16: QImage.Format_RGB16,
+               TILE_ARGB32: QImage.Format_ARGB32_Premultiplied}
+
+# Constructed AvChart objects, keyed by (chart type, chart name), least
+# recently used first. Charts a map is showing are referenced in chart_refs
+# and stay in the cache, so all maps share one AvChart per chart;
+# chart_cache_size counts only the others.
+chart_cache = OrderedDict()
+chart_cache_size = 8
+chart_cache_lock = threading.RLock()
+chart_refs = dict()
+
+# proj_fast projects with a linear approximation of the chart projection
+# around an anchor point, re-anchoring once a point is more than the anchor
+# radius (degrees) away. The radius is shrunk from FAST_PROJ_RADIUS until
+# the approximation is within FAST_PROJ_TOLERANCE chart pixels of proj.
+fast_projection = True
+FAST_PROJ_RADIUS = 0.1
+FAST_PROJ_MIN_RADIUS = 0.001
+FAST_PROJ_TOLERANCE = 0.05
+
+# Which tiles of a chart exist, as one bitmap per pyramid level, so tile
+# existence and bounds checks never have to touch the file system
+class TilePresence:
+    def __init__(self, grids):
+        self.grids = [tuple(g) for g in grids]
+        self.bits = [bytearray((c*r + 7) // 8) for c,r in self.grids]
+
+    def add(self, level, x, y):
+        columns,rows = self.grids[level]
+        n = y * columns + x
+        self.bits[level][n >> 3] |= 1 << (n & 7)
+
+    def present(self, level, x, y):
+        if level >= len(self.grids):
+            return False
+        columns,rows = self.grids[level]
+        if x < 0 or y < 0 or x >= columns or y >= rows:
+            return False
+        n = y * columns + x
+        return bool(self.bits[level][n >> 3] & (1 << (n & 7)))
+
+    def count(self, level):
+        return sum(bin(b).count('1') for b in self.bits[level])
+
+    # Compact form for a chart catalog
+    def encode(self):
+        return [[c, r, bits.hex()] for (c,r),bits in zip(self.grids, self.bits)]
+
+def decode_presence(encoded):
+    presence = TilePresence([(c,r) for c,r,bits in encoded])
+    presence.bits = [bytearray.fromhex(bits) for c,r,bits in encoded]
+    return presence
 
 class AvChart:
-    def __init__(self, name, base_name, rotated):
+    # info is the chart's entry from a chart catalog. When given, nothing
+    # has to be read from the chart directory to construct it.
+    def __init__(self, name, base_name, rotated, info=None):
         self.name = name
         self.base_name = base_name
         self.rotated = rotated
+        self.tile_dir = os.path.join(os.path.dirname(base_name), TILE_DIR)
+        # The chart cache key, when made by construct_chart
+        self.cache_key = None
+        # Whether the tiles decode to 8 bit indexed color, known once one is read
+        self.indexed = None
+        # The linearization used by proj_fast
+        self.anchor = None
+        # A packed chart has its metadata and tiles in one memory mapped file
+        pack_name = base_name + PACK_EXT
+        self.pack = ChartPack(pack_name) if os.path.exists (pack_name) else None
+        if self.pack is not None:
+            self.rotated = self.pack.rotated
+        if info is None:
+            self.read_metadata()
+        else:
+            self.set_info(info)
+        self.divisor = (self.E*self.A) - (self.B*self.D)
+        self.xconst = self.B*self.F - self.C*self.E
+        self.yconst = self.D*self.C - self.A*self.F
+        self.center_lat = (self.ulat + self.llat) / 2.0
+        self.center_lon = (self.llon + self.rlon) / 2.0
+        self.p = Proj(proj='lcc', lat_0=self.lat_0, lon_0=self.lon_0, units='m',
+                      datum='WGS84', lat_1=self.lat_1, lat_2=self.lat_2)
+
+        if info is None:
+            cx,cy = self.proj (self.center_lon, self.center_lat)
+            ux,uy = self.proj (self.center_lon, self.ulat)
+            dx = ux-cx
+            dy = uy-cy
+            self.north_angle = math.atan2(dy, dx) + math.pi # 180 degree flip because positive y is down
+
+    # Reads the projection from the .htm metadata, the world file and the tile layout
+    def read_metadata(self):
         self.lat_0=None
         self.lon_0=None
-        lat1=None
-        lat2=None
-        proj='lcc'
-        datum='WGS84'
+        self.lat_1=None
+        self.lat_2=None
         self.llon = None
         self.rlon = None
         self.ulat = None
         self.llat = None
         self.column_count = None
-        htm_name = base_name + '.htm'
-        if not os.path.exists (htm_name):
-            htm_name = base_name + '_tif.htm'
-        with open(htm_name, 'r') as htm:
-            while True:
-                line = htm.readline()
-                if line is None or len(line) == 0:
-                    htm.close()
-                    break
-                if 'Map_Projection_Name' in line:
-                    if not 'Lambert' in line:
-                        raise RuntimeError("Unrecognized map projection")
-                if 'Standard_Parallel' in line:
-                    i = line.index('Standard_Parallel')
-                    n = line.index('>', i) + 1
-                    e = line.index('<', n)
-                    p = float(line[n:e])
-                    if lat1 is not None:
-                        lat2 = p
-                        log.debug ("%s: lat2 = %g"%(base_name, lat2))
-                    else:
-                        lat1 = p
-                        log.debug ("%s: lat1 = %g"%(base_name, lat1))
-                if 'Longitude_of_Central_Meridian' in line:
-                    i = line.index('Central_Meridian')
-                    n = line.index('>', i) + 1
-                    e = line.index('<', n)
-                    self.lon_0 = float(line[n:e])
-                if 'Latitude_of_Projection_Origin' in line:
-                    i = line.index('Projection_Origin')
-                    n = line.index('>', i) + 1
-                    e = line.index('<', n)
-                    self.lat_0 = float(line[n:e])
-                if 'Column_Count' in line:
-                    i = line.index('Column_Count')
-                    n = line.index('>', i) + 1
-                    e = line.index('<', n)
-                    self.column_count = int(line[n:e])
-                if '_Bounding_Coordinate' in line:
-                    i = line.index('Coordinate')
-                    n = line.index('>', i) + 1
-                    e = line.index('<', n)
-                    coord = float(line[n:e])
-                    if 'West' in line:
-                        self.llon = coord
-                        log.debug ("West boundary of %s is %g"%(self.name, coord))
-                    elif 'East' in line:
-                        self.rlon = coord
-                        log.debug ("East boundary of %s is %g"%(self.name, coord))
-                    elif 'North' in line:
-                        self.ulat = coord
-                        log.debug ("North boundary of %s is %g"%(self.name, coord))
-                    elif 'South' in line:
-                        self.llat = coord
-                        log.debug ("South boundary of %s is %g"%(self.name, coord))
-                    else:
-                        raise RuntimeError ("%s: Unknown bounding coordinate type: %s"%(base_name, line))
+        if self.pack is not None:
+            htm = self.pack.htm.splitlines()
+        else:
+            htm_name = self.base_name + '.htm'
+            if not os.path.exists (htm_name):
+                htm_name = self.base_name + '_tif.htm'
+            with open(htm_name, 'r') as f:
+                htm = f.readlines()
+        for line in htm:
+            if 'Map_Projection_Name' in line:
+                if not 'Lambert' in line:
+                    raise RuntimeError("Unrecognized map projection")
+            if 'Standard_Parallel' in line:
+                i = line.index('Standard_Parallel')
+                n = line.index('>', i) + 1
+                e = line.index('<', n)
+                p = float(line[n:e])
+                if self.lat_1 is not None:
+                    self.lat_2 = p
+                    log.debug ("%s: lat2 = %g"%(self.base_name, self.lat_2))
+                else:
+                    self.lat_1 = p
+                    log.debug ("%s: lat1 = %g"%(self.base_name, self.lat_1))
+            if 'Longitude_of_Central_Meridian' in line:
+                i = line.index('Central_Meridian')
+                n = line.index('>', i) + 1
+                e = line.index('<', n)
+                self.lon_0 = float(line[n:e])
+            if 'Latitude_of_Projection_Origin' in line:
+                i = line.index('Projection_Origin')
+                n = line.index('>', i) + 1
+                e = line.index('<', n)
+                self.lat_0 = float(line[n:e])
+            if 'Column_Count' in line:
+                i = line.index('Column_Count')
+                n = line.index('>', i) + 1
+                e = line.index('<', n)
+                self.column_count = int(line[n:e])
+            if '_Bounding_Coordinate' in line:
+                i = line.index('Coordinate')
+                n = line.index('>', i) + 1
+                e = line.index('<', n)
+                coord = float(line[n:e])
+                if 'West' in line:
+                    self.llon = coord
+                    log.debug ("West boundary of %s is %g"%(self.name, coord))
+                elif 'East' in line:
+                    self.rlon = coord
+                    log.debug ("East boundary of %s is %g"%(self.name, coord))
+                elif 'North' in line:
+                    self.ulat = coord
+                    log.debug ("North boundary of %s is %g"%(self.name, coord))
+                elif 'South' in line:
+                    self.llat = coord
+                    log.debug ("South boundary of %s is %g"%(self.name, coord))
+                else:
+                    raise RuntimeError ("%s: Unknown bounding coordinate type: %s"%(self.base_name, line))
 
-        wfname = base_name + '.tfw'
-        if not os.path.exists (wfname):
-            wfname = base_name + '.tfwx'
-        with open(wfname, 'r') as wf:
-            constants = wf.readlines()
-            wf.close()
-            self.A,self.D, self.B,self.E, self.C,self.F = [float(c) for c in constants]
+        if self.pack is not None:
+            constants = self.pack.world.split()
+        else:
+            wfname = self.base_name + '.tfw'
+            if not os.path.exists (wfname):
+                wfname = self.base_name + '.tfwx'
+            with open(wfname, 'r') as wf:
+                constants = wf.readlines()
+        self.A,self.D, self.B,self.E, self.C,self.F = [float(c) for c in constants]
 
-        self.divisor = (self.E*self.A) - (self.B*self.D)
-        self.xconst = self.B*self.F - self.C*self.E
-        self.yconst = self.D*self.C - self.A*self.F
-        self.center_lat = (self.ulat + self.llat) / 2.0
-        self.center_lon = (self.llon + self.rlon) / 2.0
-        self.p = Proj(proj=proj, lat_0=self.lat_0, lon_0=self.lon_0, units='meters',
-                      datum=datum, lat_1=lat1, lat_2=lat2)
+        layout = None
+        layout_name = os.path.join(self.tile_dir, LAYOUT_FILE)
+        if self.pack is not None:
+            layout = self.pack.layout
+        elif os.path.exists (layout_name):
+            with open(layout_name, 'r') as lf:
+                layout = json.load(lf)
+        if layout is not None:
+            self.layout_version = layout['version']
+            if self.layout_version != TILE_LAYOUT_LEVELS:
+                raise RuntimeError ("%s: Unsupported tile layout version %s"%(self.base_name,
+                                            str(self.layout_version)))
+            self.tile_width = layout['tile_size']
+            self.tile_height = layout['tile_size']
+            self.level_grids = [tuple(g) for g in layout['levels']]
+            self.tiled_width = layout['width']
+            self.tiled_height = layout['height']
+            self.levels = len(self.level_grids)
+        else:
+            self.layout_version = TILE_LAYOUT_LEGACY
+            # Only the image header is needed to learn the tile size
+            tile0 = QImageReader(self.base_name + '00.png').size()
+            self.tile_width = tile0.width()
+            self.tile_height = tile0.height()
+        self.tile_presence = self.scan_tiles()
+        if self.layout_version == TILE_LAYOUT_LEGACY:
+            self.levels = len(self.tile_presence.grids)
+
+    # Everything read_metadata learns, plus the north angle, for a chart catalog
+    def get_info(self):
+        info = {'lat_0': self.lat_0, 'lon_0': self.lon_0,
+                'lat_1': self.lat_1, 'lat_2': self.lat_2,
+                'column_count': self.column_count,
+                'llon': self.llon, 'rlon': self.rlon, 'ulat': self.ulat, 'llat': self.llat,
+                'world': [self.A, self.D, self.B, self.E, self.C, self.F],
+                'north_angle': self.north_angle,
+                'layout_version': self.layout_version,
+                'tile_width': self.tile_width, 'tile_height': self.tile_height,
+                'levels': self.levels,
+                'tiles': self.tile_presence.encode()}
+        if self.layout_version == TILE_LAYOUT_LEVELS:
+            info['level_grids'] = [list(g) for g in self.level_grids]
+            info['tiled_width'] = self.tiled_width
+            info['tiled_height'] = self.tiled_height
+        return info
 
-        cx,cy = self.proj (self.center_lon, self.center_lat)
-        ux,uy = self.proj (self.center_lon, self.ulat)
-        dx = ux-cx
-        dy = uy-cy
-        self.north_angle = math.atan2(dy, dx) + math.pi # 180 degree flip because positive y is down
+    def set_info(self, info):
+        for k in ['lat_0', 'lon_0', 'lat_1', 'lat_2', 'column_count',
+                  'llon', 'rlon', 'ulat', 'llat', 'north_angle',
+                  'layout_version', 'tile_width', 'tile_height', 'levels']:
+            setattr(self, k, info[k])
+        self.A,self.D, self.B,self.E, self.C,self.F = info['world']
+        if self.layout_version == TILE_LAYOUT_LEVELS:
+            self.level_grids = [tuple(g) for g in info['level_grids']]
+            self.tiled_width = info['tiled_width']
+            self.tiled_height = info['tiled_height']
+        self.tile_presence = decode_presence(info['tiles'])
 
-        pxmp0 = QPixmap(base_name + '00.png')
-        self.tile_width = pxmp0.width()
-        self.tile_height = pxmp0.height()
+    # Builds the tile presence bitmaps with one directory listing per
+    # directory rather than a stat per tile
+    def scan_tiles(self):
+        if self.pack is not None:
+            presence = TilePresence(self.level_grids)
+            for level,x,y in self.pack.tiles():
+                presence.add(level, x, y)
+            return presence
+        if self.layout_version == TILE_LAYOUT_LEVELS:
+            presence = TilePresence(self.level_grids)
+            for level in range(self.levels):
+                level_dir = os.path.join(self.tile_dir, str(level))
+                for x in os.listdir(level_dir):
+                    for f in os.listdir(os.path.join(level_dir, x)):
+                        y,ext = os.path.splitext(f)
+                        if ext == '.png' and x.isdigit() and y.isdigit():
+                            presence.add(level, int(x), int(y))
+            return presence
+        found = dict()
+        base = os.path.basename(self.base_name)
+        for f in os.listdir(os.path.dirname(self.base_name) or '.'):
+            if not (f.startswith(base) and f.endswith('.png')):
+                continue
+            address = f[len(base):-len('.png')]
+            level = 0
+            if address.startswith('-'):
+                parts = address.split('-')
+                if len(parts) != 3 or not parts[1].isdigit():
+                    continue
+                level = int(parts[1])
+                address = parts[2]
+            if len(address) == 2 and address.isdigit():
+                found.setdefault(level, set()).add((int(address[0]), int(address[1])))
+        # Pyramid levels count up from full resolution without gaps
+        levels = 0
+        while levels in found:
+            levels += 1
+        # Every level of the legacy layout has the same grid as level 0
+        addresses = found.get(0, set())
+        grid = (max([x for x,y in addresses] + [-1]) + 1,
+                max([y for x,y in addresses] + [-1]) + 1)
+        presence = TilePresence([grid] * max(levels, 1))
+        for level in range(levels):
+            for x,y in found[level]:
+                presence.add(level, x, y)
+        return presence
 
     def is_valid(self):
         return not (self.llon is None or self.rlon is None or
@@ -150,10 +353,96 @@ class AvChart:
             y = self.column_count - temp - 1
         return (x,y)
 
-    def get_tile_coord(self, lon, lat):
+    # proj for whole arrays of longitudes and latitudes, in one pyproj call.
+    # Returns arrays of chart pixel coordinates multiplied by zoom.
+    def proj_many(self, lons, lats, zoom=1.0):
+        x1,y1 = self.p(numpy.asarray(lons, dtype=numpy.float64),
+                       numpy.asarray(lats, dtype=numpy.float64))
+        x = (self.E*x1 - self.B*y1 + self.xconst) / self.divisor
+        y = (self.A*y1 - self.D*x1 + self.yconst) / self.divisor
+        if self.rotated:
+            x,y = y,self.column_count - x - 1
+        return x * zoom, y * zoom
+
+    # Linear approximation of proj around lon,lat, checked against proj at
+    # the corners of the square it is used in. Returns (lon, lat, radius,
+    # x, y, dx/dlon, dx/dlat, dy/dlon, dy/dlat).
+    def linearize(self, lon, lat):
+        radius = FAST_PROJ_RADIUS
+        while True:
+            r = radius
+            xs,ys = self.proj_many([lon, lon+r, lon-r, lon, lon, lon+r, lon+r, lon-r, lon-r],
+                                   [lat, lat, lat, lat+r, lat-r, lat+r, lat-r, lat+r, lat-r])
+            xlon = (xs[1] - xs[2]) / (2*r)
+            ylon = (ys[1] - ys[2]) / (2*r)
+            xlat = (xs[3] - xs[4]) / (2*r)
+            ylat = (ys[3] - ys[4]) / (2*r)
+            error = 0.0
+            for i,(dlon,dlat) in enumerate([(r,r), (r,-r), (-r,r), (-r,-r)], 5):
+                error = max(error, abs(xs[0] + xlon*dlon + xlat*dlat - xs[i]),
+                                   abs(ys[0] + ylon*dlon + ylat*dlat - ys[i]))
+            if error <= FAST_PROJ_TOLERANCE or radius <= FAST_PROJ_MIN_RADIUS:
+                break
+            radius /= 2
+        log.log (2, "%s: anchored at %g,%g, radius %g, error %g", self.name, lon, lat, radius, error)
+        return (lon, lat, radius, float(xs[0]), float(ys[0]),
+                float(xlon), float(xlat), float(ylon), float(ylat))
+
+    # proj for positions that move a little at a time, such as ownship.
+    # There is one anchor per chart, so only the ownship position should
+    # use it; tile lookups for other positions (look-ahead, the tile server)
+    # would keep moving it.
+    def proj_fast(self, lon, lat):
+        if not fast_projection or not (math.isfinite(lon) and math.isfinite(lat)):
+            return self.proj(lon, lat)
+        anchor = self.anchor
+        if anchor is None or abs(lon - anchor[0]) > anchor[2] or abs(lat - anchor[1]) > anchor[2]:
+            anchor = self.linearize(lon, lat)
+            self.anchor = anchor
+        alon,alat,radius,x,y,xlon,xlat,ylon,ylat = anchor
+        dlon = lon - alon
+        dlat = lat - alat
+        return (x + xlon*dlon + xlat*dlat, y + ylon*dlon + ylat*dlat)
+
+    # Inverse of proj: chart pixel coordinates back to lon,lat
+    def unproj(self, x, y):
+        if self.rotated:
+            temp = y
+            y = x
+            x = self.column_count - temp - 1
+        x1 = self.A*x + self.B*y + self.C
+        y1 = self.D*x + self.E*y + self.F
+        return self.p(x1, y1, inverse=True)
+
+    # Count of full resolution tiles across and down, as laid out by make_tiles
+    def tile_grid(self):
+        return self.tile_presence.grids[0]
+
+    # Full resolution size of the tiled area, in chart pixels
+    def tiled_size(self):
+        if self.layout_version == TILE_LAYOUT_LEVELS:
+            return self.tiled_width, self.tiled_height
+        columns,rows = self.tile_grid()
+        return columns * self.tile_width, rows * self.tile_height
+
+    # Size in full resolution chart pixels covered by one tile of the level
+    def level_tile_size(self, level):
+        if self.layout_version == TILE_LAYOUT_LEVELS:
+            return self.tile_width << level, self.tile_height << level
+        # The legacy pyramid keeps the same grid at every level
+        return self.tile_width, self.tile_height
+
+    # Pyramid level used for a zoom, and the on screen size of its tiles
+    def zoom_tile_size(self, zoom):
+        level = self.level_for_zoom(zoom)
+        tw,th = self.level_tile_size(level)
+        return level, tw * zoom, th * zoom
+
+    def get_tile_coord(self, lon, lat, level=0):
+        tw,th = self.level_tile_size(level)
         x,y = self.proj(lon,lat)
-        x /= self.tile_width
-        y /= self.tile_height
+        x /= tw
+        y /= th
         x = int(x)
         y = int(y)
         return x,y
@@ -168,20 +457,130 @@ class AvChart:
             return (x,y,None)
         return self.get_tile_pixmap(x,y, just_check)
 
-    def get_tile_pixmap (self, x,y, just_check=False):
-        fname = self.base_name + str(x) + str(y) + '.png'
-        if not os.path.exists (fname):
-            log.debug ("No tile %s", fname)
+    # Name of the tile file at the given pyramid level. Level 0 is full
+    # resolution; each level above it is half the size of the one below.
+    def tile_file(self, x, y, level=0):
+        if self.layout_version == TILE_LAYOUT_LEVELS:
+            return os.path.join(self.tile_dir, str(level), str(x), str(y) + '.png')
+        if level == 0:
+            return self.base_name + str(x) + str(y) + '.png'
+        return self.base_name + '-' + str(level) + '-' + str(x) + str(y) + '.png'
+
+    # Pixel size of the tile image, as written by make_tiles
+    def tile_pixel_size(self, x, y, level=0):
+        factor = 1 << level
+        if self.layout_version == TILE_LAYOUT_LEVELS:
+            span_x,span_y = self.level_tile_size(level)
+            width = min(span_x, self.tiled_width - x * span_x)
+            height = min(span_y, self.tiled_height - y * span_y)
+        else:
+            width,height = self.tile_width,self.tile_height
+        return (width + factor - 1) // factor, (height + factor - 1) // factor
+
+    # The smallest pyramid level that still has at least the requested
+    # resolution
+    def level_for_zoom(self, zoom):
+        level = 0
+        while level+1 < self.levels and zoom <= 1.0 / (1 << (level+1)):
+            level += 1
+        return level
+
+    # Tiles are returned as QImage, so they can be loaded and painted
+    # outside of the GUI thread
+    def get_tile_pixmap (self, x,y, just_check=False, level=0):
+        if not self.tile_presence.present(level, x, y):
+            log.debug ("No tile %d,%d at level %d of %s", x, y, level, self.name)
             return (x,y,None)
         if just_check:
             return (x,y,True)
-        else:
-            return (x,y,QPixmap(fname))
+        key = tiles.key(self, x, y, level=level)
+        tp = tiles.get(key)
+        if tp is None:
+            if self.pack is not None:
+                tp = self.pack_tile(x, y, level)
+            else:
+                tp = QImage(self.tile_file(x, y, level))
+            tiles.put(key, tp)
+        # The tile may be in the cache from an earlier AvChart of this chart,
+        # so this is learned from cache hits too
+        self.indexed = tp.format() == QImage.Format_Indexed8
+        return (x,y,tp)
+
+    # Reads a tile from the chart pack. Raw tiles are wrapped where they lie
+    # in the memory map, with no decoding or copying.
+    def pack_tile(self, x, y, level):
+        encoding = self.pack.encoding
+        if encoding == TILE_PNG:
+            return QImage.fromData(self.pack.tile(level, x, y))
+        width,height = self.tile_pixel_size(x, y, level)
+        stride = raw_stride(width, encoding)
+        view = self.pack.tile_view(level, x, y)
+        if len(view) != stride * height:
+            raise RuntimeError ("%s: tile %d,%d at level %d is %d bytes, expected %d"%(
+                        self.pack.fname, x, y, level, len(view), stride * height))
+        tp = QImage(sip.voidptr(view), width, height, stride, RAW_FORMATS[encoding])
+        # The image doesn't own its pixels, so it keeps the view of them
+        tp.pack_view = view
+        return tp
+
+    # Cache key of the tile drawn at the given zoom, and its pyramid level
+    def scaled_tile_key(self, x, y, zoom):
+        level = self.level_for_zoom(zoom)
+        if zoom * (1 << level) == 1.0 or self.indexed:
+            return tiles.key(self, x, y, level=level),level
+        return tiles.key(self, x, y, zoom, level),level
+
+    # Tile scaled for the given zoom, from the tile cache where possible.
+    # It is scaled down from the nearest pyramid level at or above the zoom.
+    # Indexed color tiles are returned unscaled: scaling would expand them to
+    # 32 bits, so they stay 8 bit in the cache and are scaled as they are
+    # drawn (see construct_image).
+    def get_scaled_tile(self, x, y, zoom):
+        key,level = self.scaled_tile_key(x, y, zoom)
+        level_zoom = zoom * (1 << level)
+        if level_zoom == 1.0 or self.indexed:
+            return self.get_tile_pixmap(x,y, level=level)[2]
+        if self.get_tile_pixmap(x,y,just_check=True,level=level)[2] is None:
+            return None
+        tp = tiles.get(key)
+        if tp is not None:
+            return tp
+        tx,ty,tp = self.get_tile_pixmap(x,y, level=level)
+        if tp is None or self.indexed:
+            return tp
+        width,height = self.tile_pixel_size(x, y, level)
+        tp = tp.scaled (int(round(width*level_zoom)), int(round(height*level_zoom)),
+                        transformMode=Qt.SmoothTransformation)
+        tiles.put(key, tp)
+        return tp
+
+    # Loads a tile into the tile cache ahead of need. Returns True if it had
+    # to be decoded.
+    def prefetch_tile(self, x, y, zoom):
+        key,level = self.scaled_tile_key(x, y, zoom)
+        if tiles.contains(key):
+            return False
+        return self.get_scaled_tile(x, y, zoom) is not None
+
+    # The tiles construct_image would draw for the given position
+    def tiles_in_view(self, lon, lat, width, height, zoom):
+        level,zoom_width,zoom_height = self.zoom_tile_size(zoom)
+        begin_xindex,begin_yindex,end_xindex,end_yindex,oob = self.compute_tile_bounds (lon, lat,
+                        width, height, zoom_width, zoom_height, level)
+        ret = list()
+        for i in range(begin_xindex,end_xindex):
+            if (i - begin_xindex) * zoom_width > width:
+                break
+            for j in range(begin_yindex,end_yindex):
+                if (j - begin_yindex) * zoom_height > height:
+                    break
+                ret.append((i,j))
+        return ret
 
-    def compute_tile_bounds(self, lon, lat, width, height, zoom_width, zoom_height):
+    def compute_tile_bounds(self, lon, lat, width, height, zoom_width, zoom_height, level=0):
         imcenterx = width/2
         imcentery = height/2
-        cx,cy = self.get_tile_coord(lon, lat)
+        cx,cy = self.get_tile_coord(lon, lat, level)
         begin_xindex = cx - int(imcenterx / zoom_width)
         begin_yindex = cy - int(imcentery / zoom_height)
         log.debug ("begin_xindex = %d-int(round(%g/%g))(%d) = %d",
@@ -198,54 +597,92 @@ class AvChart:
         end_xindex = begin_xindex + int(width / zoom_width)+1
         end_yindex = begin_yindex + int(height / zoom_height)+1
         log.debug ("end_*index = %d,%d", end_xindex,end_yindex)
-        fname = self.base_name + str(end_xindex) + str(end_yindex) + '.png'
-        if not os.path.exists (fname):
+        if self.get_tile_pixmap(end_xindex, end_yindex, just_check=True, level=level)[2] is None:
             out_of_bounds = True
         return begin_xindex,begin_yindex, end_xindex,end_yindex, out_of_bounds
 
     def construct_pixmap(self, lon, lat, width, height, zoom):
-        ret = QPixmap(width, height)
+        image,corner_x,corner_y,xzoom,yzoom = self.construct_image(lon, lat, width, height, zoom)
+        return QPixmap.fromImage(image),corner_x,corner_y,xzoom,yzoom
+
+    # Safe to call outside of the GUI thread.
+    # If previous is given, it is an (image, corner_x, corner_y) tuple built
+    # earlier by this chart at the same zoom and size. The part of it that is
+    # still in view is shifted into place and only newly exposed tiles are drawn.
+    def construct_image(self, lon, lat, width, height, zoom, previous=None):
+        ret = QImage(width, height, QImage.Format_RGB32)
         ret.fill (QColor(Qt.black))
-        cx,cy,ci = self.get_tile_pixmap_pos (lon, lat)
+        cx,cy,ci = self.get_tile_pixmap_pos (lon, lat, just_check=True)
         if ci is None:
             raise RuntimeError ("longitude %g, latitude %g is not contained in map %s (tile %d,%d)"%(
                                     lon,lat,self.name,cx,cy))
 
-        zoom_width = self.tile_width * zoom
-        zoom_height = self.tile_height * zoom
+        level,zoom_width,zoom_height = self.zoom_tile_size(zoom)
         begin_xindex,begin_yindex,end_xindex,end_yindex,oob = self.compute_tile_bounds (lon, lat,
-                        width, height, zoom_width, zoom_height)
+                        width, height, zoom_width, zoom_height, level)
 
+        # Tiles are placed at whole pixel offsets computed from their absolute
+        # index, so that a shifted previous pixmap lines up exactly with new tiles
+        origin_x = int(round(begin_xindex * zoom_width))
+        origin_y = int(round(begin_yindex * zoom_height))
         painter = QPainter(ret)
-        tile_place_x = 0
-        log.debug ("const_pmp: zoom w,h = %g,%g", zoom_width, zoom_height)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        level_zoom = zoom * (1 << level)
+        kept = None
+        if previous is not None:
+            prev_image,prev_corner_x,prev_corner_y = previous
+            if prev_image is not None and prev_image.width() == width and \
+                    prev_image.height() == height:
+                prev_x = int(round(int(round(prev_corner_x / zoom_width)) * zoom_width))
+                prev_y = int(round(int(round(prev_corner_y / zoom_height)) * zoom_height))
+                kept = QRect(prev_x - origin_x, prev_y - origin_y, width, height).intersected(
+                            QRect(0, 0, width, height))
+                if kept.isEmpty():
+                    kept = None
+                else:
+                    painter.drawImage(QPoint(prev_x - origin_x, prev_y - origin_y), prev_image)
+                    log.debug ("const_img: kept %d,%d %dx%d of previous image",
+                                kept.x(), kept.y(), kept.width(), kept.height())
+
+        log.debug ("const_img: zoom w,h = %g,%g", zoom_width, zoom_height)
         for i in range(begin_xindex,end_xindex):
+            tile_place_x = int(round(i * zoom_width)) - origin_x
             if tile_place_x > width:
                 break
-            tile_place_y = 0
+            tile_right = int(round((i+1) * zoom_width)) - origin_x
             for j in range(begin_yindex,end_yindex):
+                tile_place_y = int(round(j * zoom_height)) - origin_y
                 if tile_place_y > height:
                     break
-                tx,ty,tp = self.get_tile_pixmap(i,j)
+                if kept is not None:
+                    tile_bottom = int(round((j+1) * zoom_height)) - origin_y
+                    tile_rect = QRect(QPoint(tile_place_x, tile_place_y),
+                                      QPoint(min(tile_right, width)-1, min(tile_bottom, height)-1))
+                    if kept.contains(tile_rect):
+                        continue
+                tp = self.get_scaled_tile(i,j,zoom)
                 if tp is not None:
-                    tp = tp.scaled (int(round(tp.width()*zoom)), int(round(tp.height()*zoom)),
-                                    transformMode=Qt.SmoothTransformation)
-                    painter.drawPixmap(QPoint(int(round(tile_place_x)),int(round(tile_place_y))), tp)
-                    log.debug ("const_pmp: tile %d,%d drawn at %d,%d", i,j,
-                                int(round(tile_place_x)),int(round(tile_place_y)))
-                tile_place_y += zoom_height
-            tile_place_x += zoom_width
+                    width_scaled,height_scaled = [int(round(d * level_zoom))
+                                    for d in self.tile_pixel_size(i, j, level)]
+                    if tp.width() == width_scaled and tp.height() == height_scaled:
+                        painter.drawImage(QPoint(tile_place_x,tile_place_y), tp)
+                    else:
+                        # An indexed tile is expanded and scaled only here
+                        painter.drawImage(QRect(tile_place_x, tile_place_y,
+                                                width_scaled, height_scaled), tp)
+                    log.debug ("const_img: tile %d,%d drawn at %d,%d", i,j,
+                                tile_place_x,tile_place_y)
+        painter.end()
 
         corner_x = begin_xindex * zoom_width
         corner_y = begin_yindex * zoom_height
-        xzoom,yzoom = self.get_zoom_pos(lon,lat,zoom)
-        return ret,corner_x,corner_y,xzoom,yzoom
+        x,y = self.proj(lon,lat)
+        return ret,corner_x,corner_y,x*zoom,y*zoom
 
     def compute_ul_corner(self, lon, lat, width, height, zoom):
-        zoom_width = self.tile_width * zoom
-        zoom_height = self.tile_height * zoom
+        level,zoom_width,zoom_height = self.zoom_tile_size(zoom)
         begin_xindex,begin_yindex,end_xindex,end_yindex,oob = self.compute_tile_bounds (lon, lat,
-                        width, height, zoom_width, zoom_height)
+                        width, height, zoom_width, zoom_height, level)
         corner_x = begin_xindex * zoom_width
         corner_y = begin_yindex * zoom_height
         return corner_x, corner_y, oob
@@ -254,21 +691,165 @@ class AvChart:
         cx,cy,ci = self.get_tile_pixmap_pos (lon, lat, just_check=True)
         if ci is None or ci is False:
             return False, True
-        zoom_width = self.tile_width * zoom
-        zoom_height = self.tile_height * zoom
+        level,zoom_width,zoom_height = self.zoom_tile_size(zoom)
         begin_xindex,begin_yindex,end_xindex,end_yindex,boundary_spill = \
                     self.compute_tile_bounds (lon, lat,
-                        width, height, zoom_width, zoom_height)
+                        width, height, zoom_width, zoom_height, level)
         return True,boundary_spill
 
     def get_zoom_pos(self, lon, lat, zoom):
-        chart_x,chart_y = self.proj(lon,lat)
+        chart_x,chart_y = self.proj_fast(lon,lat)
         xzoom = chart_x * zoom
         yzoom = chart_y * zoom
         return xzoom,yzoom
 
 
+# The neatline is the outline of the tiled area, which is not a lon/lat
+# rectangle on a Lambert chart. It is sampled along each edge.
+def chart_neatline(chart):
+    width,height = chart.tiled_size()
+    neatline = list()
+    n = NEATLINE_EDGE_POINTS
+    edges = [((0,0), (width,0)), ((width,0), (width,height)),
+             ((width,height), (0,height)), ((0,height), (0,0))]
+    for (x0,y0),(x1,y1) in edges:
+        for i in range(n):
+            x = x0 + (x1-x0) * i / n
+            y = y0 + (y1-y0) * i / n
+            neatline.append (chart.unproj(x,y))
+    return neatline
+
+class ChartExtent:
+    def __init__(self, name, llon, rlon, ulat, llat, neatline):
+        self.name = name
+        self.llon = llon
+        self.rlon = rlon
+        self.ulat = ulat
+        self.llat = llat
+        self.neatline = [tuple(c) for c in neatline]
+        lons = [c[0] for c in self.neatline]
+        lats = [c[1] for c in self.neatline]
+        # Cells are assigned from the union of the stated bounds and the neatline
+        self.min_lon = min(lons + [self.llon])
+        self.max_lon = max(lons + [self.rlon])
+        self.min_lat = min(lats + [self.llat])
+        self.max_lat = max(lats + [self.ulat])
+
+    def in_bounds(self, lon, lat):
+        return not (lon < self.llon or lon > self.rlon or
+                    lat > self.ulat or lat < self.llat)
+
+    def in_neatline(self, lon, lat):
+        inside = False
+        lon0,lat0 = self.neatline[-1]
+        for lon1,lat1 in self.neatline:
+            if (lat1 > lat) != (lat0 > lat):
+                cross = lon1 + (lat - lat1) * (lon0 - lon1) / (lat0 - lat1)
+                if lon < cross:
+                    inside = not inside
+            lon0,lat0 = lon1,lat1
+        return inside
+
+    def contains(self, lon, lat):
+        return self.in_bounds(lon, lat) and self.in_neatline(lon, lat)
+
+def index_cell(lon, lat):
+    return (int(math.floor(lon / INDEX_CELL_SIZE)), int(math.floor(lat / INDEX_CELL_SIZE)))
+
+def chart_extent(chart):
+    return ChartExtent(chart.name, chart.llon, chart.rlon, chart.ulat, chart.llat,
+                       chart_neatline(chart))
+
+def index_extents(chart_type, extents):
+    index = dict()
+    for extent in extents:
+        min_cell = index_cell(extent.min_lon, extent.min_lat)
+        max_cell = index_cell(extent.max_lon, extent.max_lat)
+        for i in range(min_cell[0], max_cell[0]+1):
+            for j in range(min_cell[1], max_cell[1]+1):
+                index.setdefault((i,j), list()).append(extent)
+        log.debug ("indexed chart %s of type %s", extent.name, chart_type)
+    chart_index[chart_type] = index
+
+# Loads each chart of the given type once and files its extent into the index
+def index_charts(chart_type, directory=None):
+    extents = list()
+    for ch in charts[chart_type].keys():
+        try:
+            chart = construct_chart(ch, chart_type, directory)
+        except Exception as e:
+            log.error ("Unable to index chart %s of type %s: %s", ch, chart_type, str(e))
+            continue
+        if chart is None or not chart.is_valid():
+            continue
+        extents.append (chart_extent(chart))
+    index_extents(chart_type, extents)
+
+# Returns the names of the charts of the given type whose neatline contains lon,lat
+def lookup_charts(chart_type, lon, lat, directory=None):
+    if chart_type not in chart_index:
+        index_charts(chart_type, directory)
+    cell = chart_index[chart_type].get(index_cell(lon, lat), [])
+    return [extent.name for extent in cell if extent.contains(lon, lat)]
+
+def set_fast_projection(enabled):
+    global fast_projection
+    fast_projection = bool(enabled)
+
+def set_chart_cache_size(size):
+    global chart_cache_size
+    with chart_cache_lock:
+        chart_cache_size = max(int(size), 1)
+        trim_chart_cache()
+
+# Drops the least recently used charts no map is showing, down to chart_cache_size
+def trim_chart_cache():
+    with chart_cache_lock:
+        unused = [key for key in chart_cache.keys() if key not in chart_refs]
+        for key in unused[:max(len(unused) - chart_cache_size, 0)]:
+            del chart_cache[key]
+            log.debug ("chart cache evicted %s", str(key))
+
+def clear_chart_cache():
+    with chart_cache_lock:
+        chart_cache.clear()
+
+# A map takes a reference on the chart it shows, and releases it when it
+# moves to another. Charts with references are never evicted.
+def acquire_chart(chart):
+    if chart is None or chart.cache_key is None:
+        return
+    with chart_cache_lock:
+        chart_refs[chart.cache_key] = chart_refs.get(chart.cache_key, 0) + 1
+        if chart.cache_key not in chart_cache:
+            chart_cache[chart.cache_key] = chart
+
+def release_chart(chart):
+    if chart is None or chart.cache_key is None:
+        return
+    with chart_cache_lock:
+        refs = chart_refs.get(chart.cache_key, 0) - 1
+        if refs > 0:
+            chart_refs[chart.cache_key] = refs
+        else:
+            chart_refs.pop(chart.cache_key, None)
+            trim_chart_cache()
+
 def load_chart(name, chtype, directory=None):
+    key = (chtype, name)
+    with chart_cache_lock:
+        if key in chart_cache:
+            chart_cache.move_to_end(key)
+            return chart_cache[key]
+    chart = construct_chart(name, chtype, directory)
+    if chart is not None:
+        with chart_cache_lock:
+            # Another thread may have made it meanwhile
+            chart = chart_cache.setdefault(key, chart)
+            trim_chart_cache()
+    return chart
+
+def construct_chart(name, chtype, directory=None):
     if name in charts[chtype]:
         rotated = False
         base_name = charts[chtype][name][0]
@@ -278,7 +859,8 @@ def load_chart(name, chtype, directory=None):
             base_name = os.path.join (directory, chtype, name, base_name)
         else:
             base_name = os.path.join (chtype, name, base_name)
-        ret = AvChart (name, base_name, rotated)
+        ret = AvChart (name, base_name, rotated, chart_info.get((chtype, name)))
+        ret.cache_key = (chtype, name)
         return ret
     else:
         log.error ("chart %s not found", name)
@@ -325,21 +907,10 @@ def find_chart (chart_type, lon, lat, directory):
 
 def find_charts (chart_type, lon, lat, directory, width, height, zoom):
     ret = list()
-    for ch,chinfo in charts[chart_type].items():
+    # The index has already checked the bounds and neatline, so only
+    # charts actually containing lon,lat get loaded.
+    for ch in lookup_charts(chart_type, lon, lat, directory):
         chart = load_chart(ch, chart_type, directory)
-        if chart is not None and chart.is_valid():
-            in_bounds = True
-            if lon < chart.llon:
-                in_bounds = False
-            if lon > chart.rlon:
-                in_bounds = False
-            if lat > chart.ulat:
-                in_bounds = False
-            if lat < chart.llat:
-                in_bounds = False
-            if in_bounds:
-                valid,boundary_spill = chart.check_boundaries(lon, lat,
-                                width, height, zoom)
-                if valid:
-                    ret.append(chart)
+        if chart is not None:
+            ret.append(chart)
     return ret
@@ -0,0 +1,110 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import json
+from glob import glob
+
+import pyavmap.avchart_proj as proj
+from pyavmap.chart_pack import PACK_EXT
+
+import logging
+log = logging.getLogger(__name__)
+
+# A chart catalog holds everything needed to index and construct the
+# charts in a charts directory, so startup reads one file instead of
+# globbing directories and parsing every chart's metadata.
+CATALOG_FILE = 'catalog.json'
+CATALOG_VERSION = 2
+
+# Finds the charts in the directory, filling in avchart_proj.charts
+def scan_charts (directory):
+    chart_types = [ct for ct in glob(os.path.join (directory, '*')) if os.path.isdir(ct)]
+    chart_types = [os.path.basename(ct) for ct in chart_types]
+    log.debug ("Found chart types: %s", str(chart_types))
+    for ct in chart_types:
+        proj.charts[ct] = dict()
+        chart_names = glob(os.path.join (directory, ct, '*'))
+        chart_names = [os.path.basename(cn) for cn in chart_names]
+        log.debug ("Found chart in %s: %s", ct, str(chart_names))
+        for cn in chart_names:
+            base_name = glob(os.path.join (directory, ct, cn, '*.tfw'))
+            if len(base_name) == 0:
+                base_name = glob(os.path.join (directory, ct, cn, '*.tfwx'))
+            if len(base_name) == 0:
+                base_name = glob(os.path.join (directory, ct, cn, '*' + PACK_EXT))
+            if len(base_name) == 0:
+                log.error ("Invalid chart found: %s", os.path.join (directory, ct, cn))
+                continue
+            base = os.path.basename(base_name[0])
+            base = os.path.splitext(base)[0]
+            proj.charts[ct][cn] = [base]
+            if os.path.exists (os.path.join (directory, ct, cn, 'rotated')):
+                proj.charts[ct][cn].append(True)
+            log.debug ("chart %s of type %s is defined: %s", cn, ct, str(proj.charts[ct][cn]))
+
+def build_catalog (directory, fname=None):
+    if fname is None:
+        fname = os.path.join (directory, CATALOG_FILE)
+    proj.charts.clear()
+    proj.chart_info.clear()
+    scan_charts (directory)
+    entries = list()
+    for ct in sorted(proj.charts.keys()):
+        for cn in sorted(proj.charts[ct].keys()):
+            try:
+                chart = proj.construct_chart (cn, ct, directory)
+            except Exception as e:
+                log.error ("Unable to catalog chart %s of type %s: %s", cn, ct, str(e))
+                continue
+            if chart is None or not chart.is_valid():
+                continue
+            entries.append ({'type': ct, 'name': cn,
+                             'base': proj.charts[ct][cn][0],
+                             'rotated': chart.rotated,
+                             'info': chart.get_info(),
+                             'neatline': proj.chart_neatline(chart)})
+            log.debug ("cataloged chart %s of type %s", cn, ct)
+    catalog = {'version': CATALOG_VERSION, 'charts': entries}
+    with open(fname, 'w') as f:
+        json.dump(catalog, f, separators=(',', ':'))
+    return len(entries)
+
+def load_catalog (fname):
+    with open(fname, 'r') as f:
+        catalog = json.load(f)
+    if catalog.get('version') != CATALOG_VERSION:
+        raise RuntimeError ("%s: Unsupported chart catalog version %s"%(fname,
+                                    str(catalog.get('version'))))
+    # A chart type directory changed after the catalog was built
+    directory = os.path.dirname(fname)
+    catalog_time = os.path.getmtime(fname)
+    extents = dict()
+    for entry in catalog['charts']:
+        ct = entry['type']
+        cn = entry['name']
+        proj.charts.setdefault(ct, dict())[cn] = [entry['base']]
+        if entry['rotated']:
+            proj.charts[ct][cn].append(True)
+        proj.chart_info[(ct, cn)] = entry['info']
+        info = entry['info']
+        extents.setdefault(ct, list()).append (proj.ChartExtent(cn, info['llon'], info['rlon'],
+                                    info['ulat'], info['llat'], entry['neatline']))
+    for ct,ct_extents in extents.items():
+        if os.path.getmtime(os.path.join(directory, ct)) > catalog_time:
+            log.warning ("Chart catalog %s is older than the %s charts; rebuild it", fname, ct)
+        proj.index_extents (ct, ct_extents)
+    log.info ("Loaded %d charts from catalog %s", len(catalog['charts']), fname)
@@ -0,0 +1,150 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import os
+import json
+import mmap
+import struct
+
+import logging
+log = logging.getLogger(__name__)
+
+# A packed chart holds everything make_tiles produces for one chart in a
+# single <base>.avc file:
+#
+#   header      magic, format version, metadata length, index offset, tile count
+#   metadata    JSON: the chart's .htm text, world file text, rotation,
+#               tile layout (as in tiles/layout.json) and tile encoding
+#   tiles       the encoded tile images, each starting on a TILE_ALIGN boundary
+#   index       one (level, x, y, offset, length) entry per tile
+#
+# The index comes last so the tiles can be written as they are encoded.
+# All integers are little endian.
+PACK_EXT = '.avc'
+PACK_MAGIC = b'AVCP'
+PACK_VERSION = 1
+HEADER = struct.Struct('<4sIIQI')
+INDEX_ENTRY = struct.Struct('<HHHQI')
+TILE_ALIGN = 16
+
+# Tile encodings. The raw encodings are pixels in the layout of a Qt image
+# format, so a tile can be drawn straight from the memory map without
+# decoding. Their rows are padded to a multiple of 4 bytes, and the tile
+# size follows from the layout.
+TILE_PNG = 'png'
+TILE_RGB16 = 'rgb16'            # QImage.Format_RGB16, native 5-6-5
+TILE_ARGB32 = 'argb32'          # QImage.Format_ARGB32_Premultiplied
+RAW_DEPTH = {TILE_RGB16: 2, TILE_ARGB32: 4}
+TILE_ENCODINGS = [TILE_PNG, TILE_RGB16, TILE_ARGB32]
+
+def raw_stride(width, encoding):
+    return (width * RAW_DEPTH[encoding] + 3) & ~3
+
+# Reads tiles from a packed chart through a read only memory map, so a
+# tile read is a slice of the map rather than an open and read of a file
+class ChartPack:
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise RuntimeError ("%s: Truncated chart pack"%fname)
+        magic,version,meta_len,index_offset,count = HEADER.unpack_from(self.map, 0)
+        if magic != PACK_MAGIC:
+            raise RuntimeError ("%s: Not a chart pack"%fname)
+        if version != PACK_VERSION:
+            raise RuntimeError ("%s: Unsupported chart pack version %d"%(fname, version))
+        if index_offset + count * INDEX_ENTRY.size > len(self.map):
+            raise RuntimeError ("%s: Truncated chart pack"%fname)
+        self.metadata = json.loads(self.map[HEADER.size:HEADER.size+meta_len].decode('utf-8'))
+        self.index = dict()
+        for i in range(count):
+            level,x,y,offset,length = INDEX_ENTRY.unpack_from(self.map,
+                                            index_offset + i * INDEX_ENTRY.size)
+            self.index[(level,x,y)] = (offset,length)
+        log.debug ("opened chart pack %s with %d tiles", fname, count)
+
+    @property
+    def htm(self):
+        return self.metadata['htm']
+
+    @property
+    def world(self):
+        return self.metadata['world']
+
+    @property
+    def rotated(self):
+        return self.metadata['rotated']
+
+    @property
+    def layout(self):
+        return self.metadata['layout']
+
+    @property
+    def encoding(self):
+        return self.metadata.get('encoding', TILE_PNG)
+
+    def tiles(self):
+        return self.index.keys()
+
+    # The encoded tile, or None if the pack doesn't have it
+    def tile(self, level, x, y):
+        entry = self.index.get((level,x,y))
+        if entry is None:
+            return None
+        offset,length = entry
+        return self.map[offset:offset+length]
+
+    # The tile in place in the memory map, without copying. The map can't
+    # be closed while the view is alive.
+    def tile_view(self, level, x, y):
+        entry = self.index.get((level,x,y))
+        if entry is None:
+            return None
+        offset,length = entry
+        return memoryview(self.map)[offset:offset+length]
+
+    def close(self):
+        self.map.close()
+
+# Writes a chart pack. Tiles may be added in any order.
+class PackWriter:
+    def __init__(self, fname, metadata):
+        self.fname = fname
+        self.f = open(fname + '.tmp', 'wb')
+        meta = json.dumps(metadata, separators=(',', ':')).encode('utf-8')
+        self.meta_len = len(meta)
+        self.f.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, self.meta_len, 0, 0))
+        self.f.write(meta)
+        self.index = list()
+
+    def add(self, level, x, y, data):
+        pad = -self.f.tell() % TILE_ALIGN
+        if pad:
+            self.f.write(bytes(pad))
+        self.index.append((level, x, y, self.f.tell(), len(data)))
+        self.f.write(data)
+
+    # Writes the index and moves the finished pack into place
+    def close(self):
+        index_offset = self.f.tell()
+        for entry in sorted(self.index):
+            self.f.write(INDEX_ENTRY.pack(*entry))
+        self.f.seek(0)
+        self.f.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, self.meta_len,
+                                 index_offset, len(self.index)))
+        self.f.close()
+        os.replace(self.fname + '.tmp', self.fname)
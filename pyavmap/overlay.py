@@ -0,0 +1,113 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Drawing of what goes over the chart: the ownship icon, the recorded path
+# and the extended track line. Shared by the AvMap widget and the headless
+# renderer.
+
+import math
+
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+except:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+from pyavmap.track import simplify
+
+import logging
+log = logging.getLogger(__name__)
+
+# The ownship icon, nose at 0,0
+ICON_POLY_POINTS = [
+    QPointF (0,0)
+   ,QPointF (5,5)
+   ,QPointF (20,5)
+
+   ,QPointF (30,25)
+   ,QPointF (40,25)
+   ,QPointF (35,5)
+
+   ,QPointF (50,5)
+   ,QPointF (55,10)
+   ,QPointF (65,10)
+   ,QPointF (60,0)
+   ,QPointF (65,-10)
+   ,QPointF (55,-10)
+   ,QPointF (50,-5)
+
+   ,QPointF (35,-5)
+   ,QPointF (40,-25)
+   ,QPointF (30,-25)
+
+   ,QPointF (20,-5)
+   ,QPointF (5,-5)
+]
+ICON_CENTER = QPointF(25,0)
+
+# The angle (radians) to draw the icon and extended track at. The nose
+# points along -cos,-sin of it, so pi/2 is straight up. rotation is the
+# rotation (degrees) applied to the chart under it, as in track up.
+def icon_angle(chart, track, rotation=0.0):
+    if chart is None:
+        return math.pi/2
+    return (track + rotation) * math.pi/180 + chart.north_angle
+
+# Draws the icon with its center at x,y
+def draw_ownship(p, x, y, angle, scale=1.0, fill=Qt.white, outline=Qt.black, opacity=.8):
+    p.setPen(QColor(outline))
+    p.setBrush(QColor(fill))
+    p.setOpacity (opacity)
+    ix = ICON_CENTER.x()*scale
+    iy = ICON_CENTER.y()*scale
+    cosa = math.cos(angle)
+    sina = math.sin(angle)
+    offset_x = x - (ix*cosa - iy*sina)
+    offset_y = y - (iy*cosa + ix*sina)
+    pp = [QPointF ((pt.x()*cosa - pt.y()*sina)*scale + offset_x,
+                   (pt.y()*cosa + pt.x()*sina)*scale + offset_y)
+          for pt in ICON_POLY_POINTS]
+    p.drawPolygon(QPolygonF(pp))
+
+# Draws a dotted line of the given length from x,y ahead of the icon
+def draw_extended_track(p, x, y, angle, length, color=Qt.yellow):
+    pen = QPen(QColor(color))
+    pen.setStyle(Qt.DotLine)
+    p.setPen(pen)
+    p.drawLine (QPointF(x,y), QPointF(x - length*math.cos(angle), y - length*math.sin(angle)))
+
+# Draws a polyline in zoomed chart pixels, with the chart pixel at dx,dy
+# (after any transform already set on p) as its origin
+def draw_path(p, polyline, dx, dy, color=Qt.green):
+    p.setPen(QColor(color))
+    p.setOpacity(1.0)
+    p.save()
+    p.translate (dx, dy)
+    p.drawPolyline (polyline)
+    p.restore()
+
+# The points of a TrackHistory projected into zoomed chart pixels of chart,
+# leaving out points closer than tolerance pixels to the line
+def path_polygon(chart, history, zoom, tolerance):
+    polygon = QPolygonF()
+    if len(history) > 0:
+        lons,lats = history.points()
+        coords_x,coords_y = chart.proj_many (lons, lats, zoom)
+        keep = simplify (coords_x, coords_y, tolerance)
+        for x,y in zip(coords_x[keep].tolist(), coords_y[keep].tolist()):
+            polygon.append (QPointF(x, y))
+    return polygon
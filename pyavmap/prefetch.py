@@ -0,0 +1,118 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import math
+import time
+import threading
+from collections import namedtuple
+
+import logging
+log = logging.getLogger(__name__)
+
+PrefetchRequest = namedtuple('PrefetchRequest',
+                    ['chart', 'lon', 'lat', 'track', 'gs', 'width', 'height', 'zoom'])
+
+# Wait this long before checking again when the render worker is busy
+BUSY_BACKOFF = 0.01
+
+# Dead reckons the position from track (degrees) and ground speed (knots)
+# over the given number of seconds
+def predict_position(lon, lat, track, gs, seconds):
+    distance = gs * seconds / 3600.0 / 60.0     # degrees of latitude
+    track *= math.pi / 180
+    dlat = distance * math.cos(track)
+    rel_lng = math.cos(lat * math.pi / 180)
+    dlon = distance * math.sin(track) / rel_lng if rel_lng > 1e-6 else 0
+    return lon + dlon, lat + dlat
+
+# Decodes the tiles the map will need along the predicted path into the
+# tile cache. Runs on its own thread and only works while the render
+# worker is idle, so it never delays a visible refresh.
+class Prefetcher:
+    def __init__(self, render_worker, seconds=60, step=10):
+        self.render_worker = render_worker
+        self.seconds = seconds
+        self.step = step
+        self.cond = threading.Condition()
+        self.request = None
+        self.running = True
+        self.last_tiles = None
+        self.prefetched = 0
+        self.thread = threading.Thread(target=self.run, name="Prefetcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def update(self, chart, lon, lat, track, gs, width, height, zoom):
+        with self.cond:
+            self.request = PrefetchRequest(chart, lon, lat, track, gs, width, height, zoom)
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def predicted_tiles(self, request):
+        chart = request.chart
+        needed = list()
+        t = self.step
+        while t <= self.seconds:
+            lon,lat = predict_position(request.lon, request.lat, request.track, request.gs, t)
+            for tile in chart.tiles_in_view(lon, lat, request.width, request.height, request.zoom):
+                if tile not in needed:
+                    needed.append(tile)
+            t += self.step
+        return needed
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and self.request is None:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                request = self.request
+                self.request = None
+            if request.gs <= 0 or request.chart is None:
+                continue
+            try:
+                needed = self.predicted_tiles(request)
+            except RuntimeError as e:
+                log.debug ("prefetch prediction failed: %s", str(e))
+                continue
+            except Exception:
+                log.exception ("prefetch prediction failed")
+                continue
+            if needed == self.last_tiles:
+                continue
+            for x,y in needed:
+                with self.cond:
+                    if not self.running or self.request is not None:
+                        # A newer prediction is waiting
+                        break
+                while self.running and not self.render_worker.idle():
+                    time.sleep(BUSY_BACKOFF)
+                try:
+                    if request.chart.prefetch_tile(x, y, request.zoom):
+                        self.prefetched += 1
+                        log.log (2, "prefetched %s tile %d,%d", request.chart.name, x, y)
+                except Exception:
+                    # One bad tile must not end prefetching for the session
+                    log.exception ("prefetch of %s tile %d,%d failed", request.chart.name, x, y)
+            else:
+                self.last_tiles = needed
@@ -0,0 +1,106 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import threading
+from collections import namedtuple
+
+import logging
+log = logging.getLogger(__name__)
+
+RenderRequest = namedtuple('RenderRequest',
+                    ['chart', 'lon', 'lat', 'width', 'height', 'zoom', 'generation'])
+
+# A finished background image. It is never modified after being handed over.
+MapFrame = namedtuple('MapFrame',
+                    ['image', 'corner_x', 'corner_y', 'chart', 'zoom', 'generation'])
+
+# One long lived thread that builds chart images for a map. Only the most
+# recent request is kept; any request not yet started when a newer one
+# arrives is dropped. Finished frames are passed to the callback, which
+# should hand them to the GUI thread (e.g. by emitting a signal).
+class RenderWorker:
+    def __init__(self, callback, incremental=True, name="RenderWorker"):
+        self.callback = callback
+        self.incremental = incremental
+        self.cond = threading.Condition()
+        self.request = None
+        self.running = True
+        self.busy = False
+        self.last_frame = None
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, request):
+        with self.cond:
+            if self.request is not None:
+                self.dropped += 1
+                log.log (2, "render request superseded")
+            self.request = request
+            self.cond.notify()
+
+    def idle(self):
+        with self.cond:
+            return self.request is None and not self.busy
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.request = None
+            self.cond.notify()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and self.request is None:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                request = self.request
+                self.request = None
+                self.busy = True
+            # Whatever goes wrong with one request, the worker must go on
+            # serving the next
+            frame = None
+            try:
+                frame = self.render(request)
+            except RuntimeError as e:
+                log.error ("render failure: %s %g,%g: %s", request.chart.name,
+                            request.lon, request.lat, str(e))
+            except Exception:
+                log.exception ("render failure: %s %g,%g", request.chart.name,
+                            request.lon, request.lat)
+            finally:
+                with self.cond:
+                    self.busy = False
+            if frame is not None:
+                self.last_frame = frame
+                self.callback(frame)
+
+    def render(self, request):
+        previous = None
+        last = self.last_frame
+        if self.incremental and last is not None and last.chart is request.chart and \
+                last.zoom == request.zoom:
+            previous = (last.image, last.corner_x, last.corner_y)
+        image,corner_x,corner_y,xzoom,yzoom = request.chart.construct_image(
+                    request.lon, request.lat, request.width, request.height,
+                    request.zoom, previous)
+        return MapFrame(image, corner_x, corner_y, request.chart, request.zoom,
+                        request.generation)
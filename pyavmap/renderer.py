@@ -0,0 +1,222 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Renders map frames to QImages without a widget or display, for
+# thumbnails, regression images and throughput measurement. It takes the
+# same configuration keys as AvMap and uses the same chart selection, tile
+# and overlay code.
+#
+# Like the AvMap scene, each frame is cut from a larger chart image, which
+# is rebuilt (reusing what it can of the old one) only once the position
+# nears its edge, or the chart or zoom changes.
+
+import math
+import logging
+
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+except:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+import pyavmap
+import pyavmap.avchart_proj as proj
+import pyavmap.overlay as overlay
+import pyavmap.tile_cache as tile_cache
+from pyavmap.track import TrackHistory
+
+log = logging.getLogger(__name__)
+
+# Extra chart image around what a frame needs, as a fraction of it, so the
+# image is not rebuilt on every small move
+BACKGROUND_MARGIN = 0.5
+
+class MapRenderer:
+    def __init__(self, config=None):
+        self.config = dict() if config is None else config
+        self.charts_dir = None if 'charts_dir' not in self.config else self.config['charts_dir']
+        self.chart_type = proj.CT_SECTIONAL if 'chart_type' not in self.config else self.config ['chart_type']
+        self.zoom = 1.0 if 'zoom' not in self.config else self.config['zoom']
+        self.north_is_up = True if 'north_is_up' not in self.config else self.config['north_is_up']
+        self.xoff = 0 if 'xoff' not in self.config else self.config['xoff']
+        self.yoff = 0 if 'yoff' not in self.config else self.config['yoff']
+        self.icon_opacity = .8 if 'icon_opacity' not in self.config else self.config['icon_opacity']
+        self.icon_scale = 1.0 if 'icon_scale' not in self.config else self.config['icon_scale']
+        self.icon_fill = Qt.white if 'icon_fill' not in self.config \
+                            else self.config['icon_fill']
+        self.icon_outline = Qt.black if 'icon_outline' not in self.config \
+                            else self.config['icon_outline']
+        self.show_path = False if 'show_path' not in self.config else self.config['show_path']
+        self.path_color = Qt.green if 'path_color' not in self.config else self.config['path_color']
+        self.max_path_len = 36000 if 'path_length' not in self.config else self.config['path_length']
+        self.path_history = TrackHistory(self.max_path_len)
+        self.path_tolerance = 1.0 if 'path_tolerance' not in self.config \
+                                    else self.config['path_tolerance']
+        self.extended_track_length = 100 if 'extended_track_length' not in self.config \
+                                    else self.config['extended_track_length']
+        self.el_color = Qt.yellow if 'el_color' not in self.config else self.config['el_color']
+        if 'fast_projection' in self.config:
+            proj.set_fast_projection (self.config['fast_projection'])
+        if 'chart_cache_size' in self.config:
+            proj.set_chart_cache_size (self.config['chart_cache_size'])
+        if 'tile_cache_mb' in self.config:
+            tile_cache.tiles.request_budget (id(self), self.config['tile_cache_mb'])
+
+        self.chart = None
+        # The chart image frames are cut from, and where it lies in zoomed
+        # chart pixels
+        self.background = None
+        self.corner_x = None
+        self.corner_y = None
+        self.background_zoom = None
+        # path_history projected for path_chart at path_zoom. As in AvMap,
+        # new points are projected as they are added, and the whole path is
+        # projected and simplified again after PATH_RESIMPLIFY of them.
+        self.path_polygon = None
+        self.path_chart = None
+        self.path_zoom = None
+        self.path_appended = 0
+        self.frames = 0
+        self.rebuilds = 0
+
+    # Gives up this renderer's share of the chart and tile caches
+    def close(self):
+        proj.release_chart (self.chart)
+        self.chart = None
+        self.background = None
+        tile_cache.tiles.release (id(self))
+
+    # Adds a point to the path drawn when show_path is set
+    def add_path_point(self, lon, lat):
+        dropped = self.path_history.append (lon, lat)
+        if self.path_polygon is not None and not dropped and \
+                self.path_appended < pyavmap.PATH_RESIMPLIFY:
+            x,y = self.path_chart.proj_fast (lon, lat)
+            self.path_polygon.append (QPointF(x*self.path_zoom, y*self.path_zoom))
+            self.path_appended += 1
+        else:
+            self.path_polygon = None
+
+    def clear_path(self):
+        self.path_history.clear()
+        self.path_polygon = None
+
+    def path_polyline(self, zoom):
+        if self.path_polygon is None or self.path_chart is not self.chart or self.path_zoom != zoom:
+            self.path_polygon = overlay.path_polygon (self.chart, self.path_history,
+                                    zoom, self.path_tolerance)
+            self.path_chart = self.chart
+            self.path_zoom = zoom
+            self.path_appended = 0
+        return self.path_polygon
+
+    # Whether the current background holds the half_width x half_height
+    # box around the zoomed chart position x,y
+    def covers(self, x, y, half_width, half_height):
+        return x - self.corner_x >= half_width and \
+               y - self.corner_y >= half_height and \
+               self.corner_x + self.background.width() - x >= half_width and \
+               self.corner_y + self.background.height() - y >= half_height
+
+    def background_size(self, chart, zoom, half_width, half_height):
+        level,zoom_width,zoom_height = chart.zoom_tile_size(zoom)
+        return (int(2 * half_width * (1 + BACKGROUND_MARGIN) + 2 * zoom_width),
+                int(2 * half_height * (1 + BACKGROUND_MARGIN) + 2 * zoom_height))
+
+    # Makes the background cover half_width x half_height around lon,lat.
+    # As in AvMap, the chart is kept until the position nears its edge.
+    def update_background(self, chart_type, lon, lat, track, zoom, half_width, half_height):
+        chart = self.chart if chart_type == self.chart_type else None
+        if chart is not None and self.background is not None and self.background_zoom == zoom:
+            x,y = chart.get_zoom_pos (lon, lat, zoom)
+            if self.covers (x, y, half_width, half_height):
+                return
+        if chart is not None:
+            width,height = self.background_size (chart, zoom, half_width, half_height)
+            cx,cy,oob = chart.compute_ul_corner (lon, lat, width, height, zoom)
+            if oob:
+                candidates = proj.find_charts (chart_type, lon, lat, self.charts_dir, width, height, zoom)
+                better = pyavmap.best_chart (candidates, lon, lat, track)
+                if better is not None and better.name != chart.name:
+                    log.debug ("Out of bounds. change chart to %s", better.name)
+                    chart = better
+                elif self.background_zoom == zoom and (cx,cy) == (self.corner_x,self.corner_y) and \
+                        (width,height) == (self.background.width(),self.background.height()):
+                    # At the edge of the chart, and this is all there is of it
+                    return
+        else:
+            candidates = proj.find_charts (chart_type, lon, lat, self.charts_dir, 0, 0, zoom)
+            chart = pyavmap.best_chart (candidates, lon, lat, track)
+            if chart is None:
+                raise RuntimeError ("No %s chart found for %g,%g"%(chart_type, lon, lat))
+        width,height = self.background_size (chart, zoom, half_width, half_height)
+        previous = None
+        if chart is self.chart and self.background_zoom == zoom:
+            previous = (self.background, self.corner_x, self.corner_y)
+        self.background,self.corner_x,self.corner_y,xzoom,yzoom = \
+                    chart.construct_image (lon, lat, width, height, zoom, previous)
+        if chart is not self.chart:
+            proj.acquire_chart (chart)
+            proj.release_chart (self.chart)
+            self.chart = chart
+        tile_cache.tiles.reserve (id(self), width * height * 4)
+        self.chart_type = chart_type
+        self.background_zoom = zoom
+        self.rebuilds += 1
+
+    # Returns a width x height QImage of the map at lat,lon. Arguments left
+    # as None take the configured value. With north_is_up False the map is
+    # turned so the track is up.
+    def render(self, lat, lon, track=0.0, width=640, height=480, zoom=None,
+               north_is_up=None, chart_type=None):
+        zoom = self.zoom if zoom is None else zoom
+        north_is_up = self.north_is_up if north_is_up is None else north_is_up
+        chart_type = self.chart_type if chart_type is None else chart_type
+        bx = width/2 + self.xoff
+        by = height/2 + self.yoff
+        # How far the frame reaches from ownship, in chart pixels
+        reach_x = max(bx, width - bx)
+        reach_y = max(by, height - by)
+        if not north_is_up:
+            reach_x = reach_y = math.hypot(reach_x, reach_y)
+        self.update_background (chart_type, lon, lat, track, zoom,
+                                int(math.ceil(reach_x)), int(math.ceil(reach_y)))
+        xzoom,yzoom = self.chart.get_zoom_pos (lon, lat, zoom)
+
+        image = QImage(width, height, QImage.Format_RGB32)
+        image.fill (QColor(Qt.black))
+        p = QPainter(image)
+        rotation = 0.0
+        p.translate (bx, by)
+        if not north_is_up:
+            cna = self.chart.north_angle * 180 / math.pi
+            rotation = -track - (cna - 90)
+            p.rotate (rotation)
+        p.drawImage (QPointF(self.corner_x - xzoom, self.corner_y - yzoom), self.background)
+        p.setRenderHint(QPainter.Antialiasing)
+        if self.show_path and len(self.path_history) >= 2:
+            overlay.draw_path (p, self.path_polyline(zoom), -xzoom, -yzoom, self.path_color)
+        p.resetTransform()
+
+        angle = overlay.icon_angle (self.chart, track, rotation)
+        overlay.draw_ownship (p, bx, by, angle, self.icon_scale,
+                              self.icon_fill, self.icon_outline, self.icon_opacity)
+        if self.extended_track_length > 0:
+            overlay.draw_extended_track (p, bx, by, angle, self.extended_track_length, self.el_color)
+        p.end()
+        self.frames += 1
+        return image
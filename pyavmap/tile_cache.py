@@ -0,0 +1,131 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import threading
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger(__name__)
+
+# Zoom levels closer than this share scaled tiles
+ZOOM_QUANTUM = 0.001
+
+def quantize_zoom(zoom):
+    if zoom is None:
+        return None
+    return int(round(zoom / ZOOM_QUANTUM))
+
+def image_bytes(image):
+    return image.width() * image.height() * max(image.depth(), 8) // 8
+
+# Decoded tiles, keyed by (chart base name, pyramid level, x, y, quantized
+# zoom). The tile as read from disk is stored under a zoom of None.
+#
+# There is one cache for the process, shared by every map. Maps may each
+# ask for a budget with request_budget; the largest asked for applies. Maps
+# register the memory of their own background images with reserve. That is
+# held in addition to the budget, not charged against it, so the tiles of
+# a single map keep the whole budget; it is reported by stats so the total
+# memory of all maps can be seen.
+class TileCache:
+    def __init__(self, budget_mb=64):
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.default_budget = self.budget
+        self.requested = dict()
+        self.reserved = dict()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, chart, x, y, zoom=None, level=0):
+        return (chart.base_name, level, x, y, quantize_zoom(zoom))
+
+    def get(self, key):
+        with self.lock:
+            image = self.tiles.get(key)
+            if image is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.tiles.move_to_end(key)
+            return image
+
+    # Checks for a tile without counting a hit or miss
+    def contains(self, key):
+        with self.lock:
+            return key in self.tiles
+
+    def put(self, key, image):
+        size = image_bytes(image)
+        with self.lock:
+            if key in self.tiles:
+                self.used -= image_bytes(self.tiles.pop(key))
+            self.tiles[key] = image
+            self.used += size
+            self.evict()
+
+    def evict(self):
+        while self.used > self.budget and len(self.tiles) > 1:
+            key,image = self.tiles.popitem(last=False)
+            self.used -= image_bytes(image)
+            log.log (2, "tile cache evicted %s", str(key))
+
+    def set_budget(self, budget_mb):
+        with self.lock:
+            self.budget = int(budget_mb * 1024 * 1024)
+            self.default_budget = self.budget
+            self.evict()
+
+    def request_budget(self, owner, budget_mb):
+        with self.lock:
+            self.requested[owner] = int(budget_mb * 1024 * 1024)
+            self.budget = max(self.requested.values())
+            self.evict()
+
+    # Records nbytes held by owner outside the cache, on top of the budget
+    def reserve(self, owner, nbytes):
+        with self.lock:
+            self.reserved[owner] = int(nbytes)
+
+    # Drops the budget request and reservation of owner
+    def release(self, owner):
+        with self.lock:
+            self.reserved.pop(owner, None)
+            self.requested.pop(owner, None)
+            if self.requested:
+                self.budget = max(self.requested.values())
+            else:
+                self.budget = self.default_budget
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.used = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'tiles': len(self.tiles),
+                    'used_mb': self.used / (1024.0 * 1024.0),
+                    'budget_mb': self.budget / (1024.0 * 1024.0),
+                    'reserved_mb': sum(self.reserved.values()) / (1024.0 * 1024.0),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': (self.hits / total) if total else 0.0}
+
+tiles = TileCache()
@@ -0,0 +1,317 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Serves the installed charts over HTTP as web mercator (XYZ) tiles, at
+#   /<chart type>/<z>/<x>/<y>.png
+# so several displays can share one box's decoding and scaling.
+#
+# Each tile is resampled from a chart image built by AvChart.construct_image
+# at the nearest power of two zoom, so it comes from the same tile sets,
+# pyramid levels and tile cache as the map. Finished PNGs are kept in memory
+# and on disk, and carry an ETag so clients can revalidate with
+# If-None-Match.
+
+import os
+import re
+import json
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy
+
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+except:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+import pyavmap.avchart_proj as proj
+
+import logging
+log = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+MIN_TILE_ZOOM = 4           # XYZ zoom levels below this are not served
+MAX_TILE_ZOOM = 16
+MIN_CHART_ZOOM = 1.0 / 32   # The smallest chart zoom tiles are resampled from
+TILE_PATH = re.compile(r'^/([^/]+)/(\d+)/(\d+)/(\d+)\.png$')
+
+# Longitudes of columns and latitudes of rows of pixel centers of an XYZ tile
+def tile_lon_lats(z, x, y, size=TILE_SIZE):
+    n = float(1 << z)
+    steps = (numpy.arange(size) + 0.5) / size
+    lons = (x + steps) / n * 360.0 - 180.0
+    lats = numpy.degrees(numpy.arctan(numpy.sinh(math.pi * (1 - 2 * (y + steps) / n))))
+    return lons,lats
+
+# The strong ETag of a response body
+def make_etag(data):
+    return '"%s"'%hashlib.sha1(data).hexdigest()[:20]
+
+# Finished tiles as (etag, png data), least recently used dropped first.
+# Tiles with no chart coverage are kept with data None.
+class ResponseCache:
+    def __init__(self, budget_mb=32):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return entry
+
+    # get without counting a hit or miss
+    def peek(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, entry):
+        size = len(entry[1] or b'')
+        with self.lock:
+            if key in self.entries:
+                self.used -= len(self.entries.pop(key)[1] or b'')
+            self.entries[key] = entry
+            self.used += size
+            while self.used > self.budget and len(self.entries) > 1:
+                evicted,old = self.entries.popitem(last=False)
+                self.used -= len(old[1] or b'')
+
+    def stats(self):
+        with self.lock:
+            return {'tiles': len(self.entries), 'used_mb': self.used / (1024.0 * 1024.0),
+                    'hits': self.hits, 'misses': self.misses}
+
+# Renders XYZ tiles from the configured charts, through the memory and disk
+# caches. configure_charts must have been called.
+class XyzTiles:
+    def __init__(self, charts_dir, cache_dir=None, cache_mb=32, tile_size=TILE_SIZE):
+        self.charts_dir = charts_dir
+        self.tile_size = tile_size
+        self.memory = ResponseCache(cache_mb)
+        self.cache_dir = None
+        if cache_dir is not None:
+            # Tiles cut from a different set of charts go in a different place
+            self.cache_dir = os.path.join(cache_dir, self.chart_set_signature())
+        self.lock = threading.Lock()
+        self.in_progress = dict()
+        self.rendered = 0
+
+    # Changes whenever a chart is added, removed or rewritten
+    def chart_set_signature(self):
+        h = hashlib.sha1(str(self.tile_size).encode('utf-8'))
+        for ct in sorted(proj.charts.keys()):
+            for name in sorted(proj.charts[ct].keys()):
+                chart_dir = os.path.join(self.charts_dir, ct, name)
+                mtime = os.stat(chart_dir).st_mtime if os.path.exists(chart_dir) else 0
+                h.update(("%s/%s/%s/%g\n"%(ct, name, proj.charts[ct][name][0], mtime)).encode('utf-8'))
+        return h.hexdigest()[:16]
+
+    def disk_name(self, chart_type, z, x, y):
+        return os.path.join(self.cache_dir, chart_type, str(z), str(x), "%d.png"%y)
+
+    # Returns (etag, png data) for a tile, with data None if no chart covers it
+    def get(self, chart_type, z, x, y):
+        key = (chart_type, z, x, y)
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry
+        # Concurrent requests for a tile wait for the first to render it
+        with self.lock:
+            tile_lock = self.in_progress.setdefault(key, threading.Lock())
+        with tile_lock:
+            entry = self.memory.peek(key)
+            if entry is None:
+                entry = self.load(chart_type, z, x, y)
+                self.memory.put(key, entry)
+        with self.lock:
+            self.in_progress.pop(key, None)
+        return entry
+
+    def load(self, chart_type, z, x, y):
+        fname = None
+        if self.cache_dir is not None:
+            fname = self.disk_name(chart_type, z, x, y)
+            if os.path.exists(fname):
+                with open(fname, 'rb') as f:
+                    data = f.read()
+                if len(data) == 0:
+                    return (None, None)
+                return (make_etag(data), data)
+        data = self.render(chart_type, z, x, y)
+        if fname is not None:
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            temp = fname + '.tmp%d'%threading.get_ident()
+            with open(temp, 'wb') as f:
+                f.write(data or b'')
+            os.replace(temp, fname)
+        if data is None:
+            return (None, None)
+        return (make_etag(data), data)
+
+    # Charts whose index cells overlap the tile, those containing its
+    # center first
+    def tile_charts(self, chart_type, lons, lats):
+        names = proj.lookup_charts(chart_type, lons[len(lons)//2], lats[len(lats)//2], self.charts_dir)
+        index = proj.chart_index[chart_type]
+        min_i,min_j = proj.index_cell(lons[0], lats[-1])
+        max_i,max_j = proj.index_cell(lons[-1], lats[0])
+        for i in range(min_i, max_i+1):
+            for j in range(min_j, max_j+1):
+                for extent in index.get((i,j), []):
+                    if extent.name not in names:
+                        names.append(extent.name)
+        charts = [proj.load_chart(name, chart_type, self.charts_dir) for name in names]
+        return [ch for ch in charts if ch is not None and ch.is_valid()]
+
+    # PNG data of an XYZ tile, or None if no chart covers it
+    def render(self, chart_type, z, x, y):
+        size = self.tile_size
+        lons,lats = tile_lon_lats(z, x, y, size)
+        charts = self.tile_charts(chart_type, lons, lats)
+        if len(charts) == 0:
+            return None
+        lon_grid,lat_grid = numpy.meshgrid(lons, lats)
+        pixels = numpy.zeros((size, size), dtype=numpy.uint32)
+        filled = numpy.zeros((size, size), dtype=bool)
+        for chart in charts:
+            self.draw_chart(chart, lon_grid, lat_grid, pixels, filled)
+            if filled.all():
+                break
+        if not filled.any():
+            return None
+        self.rendered += 1
+        image = QImage(pixels.data, size, size, size * 4, QImage.Format_ARGB32)
+        data = QByteArray()
+        buf = QBuffer(data)
+        buf.open(QIODevice.WriteOnly)
+        image.save(buf, 'PNG')
+        buf.close()
+        return bytes(data)
+
+    # Fills the pixels not yet filled that lie on the chart
+    def draw_chart(self, chart, lon_grid, lat_grid, pixels, filled):
+        xs,ys = chart.proj_many(lon_grid, lat_grid)
+        width,height = chart.tiled_size()
+        on_chart = (xs >= 0) & (ys >= 0) & (xs < width) & (ys < height) & ~filled
+        if not on_chart.any():
+            return
+        # The largest power of two zoom at which a tile pixel spans no more
+        # than one chart image pixel, so none are skipped. Powers of two
+        # share scaled chart tiles between neighboring XYZ tiles.
+        size = pixels.shape[0]
+        scale = math.hypot(xs[0,-1] - xs[0,0], ys[0,-1] - ys[0,0]) / (size - 1)
+        zoom = 1.0
+        while zoom > MIN_CHART_ZOOM and zoom * scale > 1.0:
+            zoom /= 2
+        # The chart image covering the part of the chart in the tile
+        min_x,max_x = max(xs[on_chart].min(), 0),min(xs[on_chart].max(), width - 1)
+        min_y,max_y = max(ys[on_chart].min(), 0),min(ys[on_chart].max(), height - 1)
+        level,zoom_width,zoom_height = chart.zoom_tile_size(zoom)
+        half_width = (max_x - min_x) * zoom / 2 + 1
+        half_height = (max_y - min_y) * zoom / 2 + 1
+        lon,lat = chart.unproj((min_x + max_x) / 2, (min_y + max_y) / 2)
+        try:
+            image,corner_x,corner_y,xzoom,yzoom = chart.construct_image(lon, lat,
+                        int(2 * (half_width + zoom_width)), int(2 * (half_height + zoom_height)), zoom)
+        except RuntimeError as e:
+            log.debug ("tile server: %s", str(e))
+            return
+        ptr = image.constBits()
+        ptr.setsize(image.byteCount())
+        source = numpy.frombuffer(ptr, dtype=numpy.uint32).reshape(
+                        image.height(), image.bytesPerLine() // 4)
+        px = numpy.floor(xs * zoom - corner_x).astype(numpy.int64)
+        py = numpy.floor(ys * zoom - corner_y).astype(numpy.int64)
+        on_chart &= (px >= 0) & (py >= 0) & (px < image.width()) & (py < image.height())
+        pixels[on_chart] = source[py[on_chart], px[on_chart]] | 0xff000000
+        filled |= on_chart
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    tiles = None                # The XyzTiles served
+    max_age = 3600
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def respond(self, send_body):
+        if self.path in ('/', '/index.json'):
+            body = json.dumps({'chart_types': sorted(proj.charts.keys()),
+                               'tiles': '/{chart_type}/{z}/{x}/{y}.png',
+                               'minzoom': MIN_TILE_ZOOM, 'maxzoom': MAX_TILE_ZOOM,
+                               'tile_size': self.tiles.tile_size,
+                               'cache': self.tiles.memory.stats()}).encode('utf-8')
+            return self.send(200, 'application/json', body, None, send_body)
+        m = TILE_PATH.match(self.path.split('?')[0])
+        if m is None:
+            return self.send_error(404)
+        chart_type = m.group(1)
+        z,x,y = [int(v) for v in m.groups()[1:]]
+        if chart_type not in proj.charts or z < MIN_TILE_ZOOM or z > MAX_TILE_ZOOM or \
+                x >= (1 << z) or y >= (1 << z):
+            return self.send_error(404)
+        try:
+            etag,data = self.tiles.get(chart_type, z, x, y)
+        except Exception as e:
+            log.error ("tile %s/%d/%d/%d failed: %s", chart_type, z, x, y, str(e))
+            return self.send_error(500)
+        if data is None:
+            return self.send_error(404)
+        if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+            return self.send(304, None, None, etag, False)
+        self.send(200, 'image/png', data, etag, send_body)
+
+    def send(self, code, content_type, body, etag, send_body):
+        self.send_response(code)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'max-age=%d'%self.max_age)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body and body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug ("%s %s", self.address_string(), format%args)
+
+# Serves tiles until interrupted. configure_charts must have been called.
+def serve(tiles, host='127.0.0.1', port=8080, max_age=3600):
+    handler = type('Handler', (TileRequestHandler,), {'tiles': tiles, 'max_age': max_age})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    log.info ("Serving %s tiles on http://%s:%d/", ', '.join(sorted(proj.charts.keys())), host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,99 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import numpy
+
+import logging
+log = logging.getLogger(__name__)
+
+# The recorded track, oldest point first, in fixed size arrays used as a
+# ring buffer. Once full, each new point overwrites the oldest.
+class TrackHistory:
+    def __init__(self, capacity):
+        self.capacity = max(int(capacity), 2)
+        self.lons = numpy.empty(self.capacity)
+        self.lats = numpy.empty(self.capacity)
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # Adds a point. Returns True if the oldest point was dropped to make room.
+    def append(self, lon, lat):
+        end = (self.start + self.count) % self.capacity
+        self.lons[end] = lon
+        self.lats[end] = lat
+        if self.count < self.capacity:
+            self.count += 1
+            return False
+        self.start = (self.start + 1) % self.capacity
+        return True
+
+    def first(self):
+        if self.count == 0:
+            return None
+        return self.lons[self.start],self.lats[self.start]
+
+    def last(self):
+        if self.count == 0:
+            return None
+        end = (self.start + self.count - 1) % self.capacity
+        return self.lons[end],self.lats[end]
+
+    # Longitudes and latitudes in order, as arrays
+    def points(self):
+        end = self.start + self.count
+        if end <= self.capacity:
+            return self.lons[self.start:end],self.lats[self.start:end]
+        end -= self.capacity
+        return (numpy.concatenate((self.lons[self.start:], self.lons[:end])),
+                numpy.concatenate((self.lats[self.start:], self.lats[:end])))
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+# Douglas-Peucker simplification of a polyline. Returns the indices of the
+# points to keep, so that no dropped point is further than tolerance from
+# the simplified line. The first and last points are always kept.
+def simplify(xs, ys, tolerance):
+    n = len(xs)
+    if n < 3:
+        return numpy.arange(n)
+    keep = numpy.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n-1)]
+    while stack:
+        first,last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = xs[last] - xs[first]
+        dy = ys[last] - ys[first]
+        px = xs[first+1:last] - xs[first]
+        py = ys[first+1:last] - ys[first]
+        length = numpy.hypot(dx, dy)
+        if length > 0:
+            dist = numpy.abs(px * dy - py * dx) / length
+        else:
+            dist = numpy.hypot(px, py)
+        i = int(numpy.argmax(dist))
+        if dist[i] > tolerance:
+            i += first + 1
+            keep[i] = True
+            stack.append((first, i))
+            stack.append((i, last))
+    return numpy.flatnonzero(keep)
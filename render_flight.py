@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Renders a recorded flight as a numbered PNG sequence, for debrief videos
+# and regression image sets. Frames are drawn by pyavmap.renderer with a
+# pool of processes, each taking runs of consecutive frames so its chart
+# image and its chart and tile caches carry over from frame to frame.
+#
+# The track file is CSV with lat, lon, track and time (seconds) columns, in
+# that order unless a header line names them. Lines starting with # are
+# ignored.
+
+import sys, os, time
+import csv
+import math
+import argparse
+import logging
+import multiprocessing
+import yaml
+
+log = logging.getLogger(__name__)
+
+TRACK_COLUMNS = ['lat', 'lon', 'track', 'time']
+
+# Returns a list of (time, lat, lon, track), in time order
+def read_track(fname):
+    points = list()
+    columns = TRACK_COLUMNS
+    with open(fname, 'r', newline='') as f:
+        for row in csv.reader(line for line in f if not line.startswith('#')):
+            if len(row) == 0:
+                continue
+            try:
+                values = [float(v) for v in row]
+            except ValueError:
+                if len(points) == 0:
+                    columns = [v.strip().lower() for v in row]
+                    missing = [c for c in TRACK_COLUMNS if c not in columns]
+                    if missing:
+                        raise RuntimeError ("%s: No %s column"%(fname, ', '.join(missing)))
+                    continue
+                raise RuntimeError ("%s: Bad line %s"%(fname, ','.join(row)))
+            v = dict(zip(columns, values))
+            points.append ((v['time'], v['lat'], v['lon'], v['track']))
+    if len(points) == 0:
+        raise RuntimeError ("%s: No track points"%fname)
+    points.sort()
+    return points
+
+# The position and track at time t, interpolated between track points
+def interpolate(points, times, t, index):
+    while index + 1 < len(points) and times[index + 1] <= t:
+        index += 1
+    t0,lat0,lon0,track0 = points[index]
+    if index + 1 >= len(points) or t <= t0:
+        return lat0,lon0,track0,index
+    t1,lat1,lon1,track1 = points[index + 1]
+    f = (t - t0) / (t1 - t0)
+    turn = (track1 - track0 + 180) % 360 - 180
+    return lat0 + (lat1 - lat0) * f, lon0 + (lon1 - lon0) * f, (track0 + turn * f) % 360, index
+
+# Frame number and time of each frame. fps 0 gives one frame per track point.
+def frame_times(points, fps):
+    if fps <= 0:
+        return [p[0] for p in points]
+    start = points[0][0]
+    count = int(math.floor((points[-1][0] - start) * fps)) + 1
+    return [start + i / fps for i in range(count)]
+
+# State of each worker process
+renderer = None
+app = None
+flight = None
+output = None
+
+def init_worker(config, points, times, frame_output):
+    global renderer, app, flight, output
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtGui import QGuiApplication
+    except:
+        from PyQt4.QtGui import QApplication as QGuiApplication
+    import pyavmap
+    from pyavmap.renderer import MapRenderer
+    app = QGuiApplication([sys.argv[0]])
+    pyavmap.configure_charts (config['charts_dir'])
+    renderer = MapRenderer(config)
+    flight = (points, [p[0] for p in points], times)
+    output = frame_output
+
+# A black frame, written in place of one that could not be drawn
+def blank_frame(width, height):
+    try:
+        from PyQt5.QtGui import QImage, QColor
+    except:
+        from PyQt4.QtGui import QImage, QColor
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill (QColor(0, 0, 0))
+    return image
+
+# Renders frames first to last-1 of the flight. Returns the number of
+# frames written. A frame that cannot be drawn is written as a copy of the
+# one before it (or black), as image sequence readers such as ffmpeg stop
+# at the first missing number.
+def render_frames(job):
+    first,last = job
+    points,point_times,times = flight
+    directory,name,width,height = output
+    renderer.clear_path()
+    index = 0
+    path_index = 0
+    written = 0
+    image = None
+    for frame in range(first, last):
+        t = times[frame]
+        lat,lon,track,index = interpolate(points, point_times, t, index)
+        if renderer.show_path:
+            while path_index < len(points) and points[path_index][0] <= t:
+                renderer.add_path_point (points[path_index][2], points[path_index][1])
+                path_index += 1
+        try:
+            image = renderer.render (lat, lon, track, width, height)
+        except RuntimeError as e:
+            log.error ("frame %d at %g,%g: %s", frame, lon, lat, str(e))
+            if image is None:
+                image = blank_frame(width, height)
+        image.save (os.path.join(directory, name%frame))
+        written += 1
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a recorded flight to a PNG sequence')
+    parser.add_argument('track_file', help='CSV of lat, lon, track and time (seconds)')
+    parser.add_argument('output', help='Directory to write the frames to')
+    parser.add_argument('--config-file', default='config/main.yaml', type=argparse.FileType('r'),
+                        help='pyAvMap configuration for the charts directory and map settings')
+    parser.add_argument('--charts-dir', help='Charts directory (default charts_dir of the configuration)')
+    parser.add_argument('--fps', type=float, default=10.0,
+                        help='Frames per second of flight time; 0 renders one frame per track point')
+    parser.add_argument('--speedup', type=float, default=1.0,
+                        help='Flight seconds per video second, dividing the number of frames')
+    parser.add_argument('--width', type=int, default=None, help='Frame width (default screenWidth)')
+    parser.add_argument('--height', type=int, default=None, help='Frame height (default screenHeight)')
+    parser.add_argument('--zoom', type=float, default=None, help='Map zoom (default zoom of the configuration)')
+    parser.add_argument('--track-up', action='store_true', help='Turn the map so the track is up')
+    parser.add_argument('--chart-type', default=None, help='Chart type (default chart_type of the configuration)')
+    parser.add_argument('--name', default='frame%06d.png', help='Frame file name pattern')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='Number of rendering processes')
+    parser.add_argument('--chunk', type=int, default=250,
+                        help='Consecutive frames given to a process at a time')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Run in verbose mode')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    config = yaml.safe_load(args.config_file)
+    if args.charts_dir is not None:
+        config['charts_dir'] = args.charts_dir
+    if args.zoom is not None:
+        config['zoom'] = args.zoom
+    if args.chart_type is not None:
+        config['chart_type'] = args.chart_type
+    if args.track_up:
+        config['north_is_up'] = False
+    main_config = {} if 'main' not in config else config['main']
+    if args.width is None:
+        args.width = int(main_config.get('screenWidth', 1000))
+    if args.height is None:
+        args.height = int(main_config.get('screenHeight', 700))
+    config = dict((k,v) for k,v in config.items() if k not in ('main', 'displays', 'menu',
+                        'keybindings', 'databindings', 'logging'))
+
+    points = read_track(args.track_file)
+    times = frame_times(points, args.fps / args.speedup if args.fps > 0 else 0)
+    os.makedirs(args.output, exist_ok=True)
+    jobs = [(first, min(first + args.chunk, len(times)))
+            for first in range(0, len(times), max(args.chunk, 1))]
+    print ("Rendering %d frames of %.0f seconds of flight in %d jobs"%(len(times),
+                points[-1][0] - points[0][0], len(jobs)))
+
+    # Qt must not be running in the parent of a forked worker, so each
+    # worker is a fresh interpreter
+    ctx = multiprocessing.get_context('spawn')
+    start = time.time()
+    frames = 0
+    with ctx.Pool(max(args.jobs, 1), initializer=init_worker,
+                  initargs=(config, points, times, (args.output, args.name, args.width, args.height))) as pool:
+        for done,written in enumerate(pool.imap_unordered(render_frames, jobs), 1):
+            frames += written
+            elapsed = max(time.time() - start, 1e-6)
+            print ("%d/%d jobs, %d frames, %.1f frames/s"%(done, len(jobs), frames, frames / elapsed))
+    elapsed = time.time() - start
+    print ("Wrote %d frames to %s in %.1f seconds (%.1f frames/s) with %d workers"%(
+                frames, args.output, elapsed, frames / elapsed, args.jobs))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+# Serves the installed charts as XYZ tiles over HTTP. See
+# pyavmap/tile_server.py.
+
+import sys, os
+import argparse
+import logging
+import yaml
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+try:
+    from PyQt5.QtGui import QGuiApplication
+except:
+    from PyQt4.QtGui import QApplication as QGuiApplication
+
+import pyavmap
+import pyavmap.avchart_proj as proj
+import pyavmap.tile_cache as tile_cache
+from pyavmap.tile_server import XyzTiles, serve
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve pyAvMap charts as XYZ tiles')
+    parser.add_argument('--config-file', default='config/main.yaml', type=argparse.FileType('r'),
+                        help='pyAvMap configuration, for charts_dir and tile_cache_mb')
+    parser.add_argument('--charts-dir', help='Charts directory (default charts_dir of the configuration)')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-dir', default=None,
+                        help='Keep rendered tiles here across restarts (default memory only)')
+    parser.add_argument('--cache-mb', type=float, default=64,
+                        help='Memory for rendered tiles, in addition to tile_cache_mb for chart tiles')
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--max-age', type=int, default=3600,
+                        help='Seconds clients may use a tile before revalidating it')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Run in verbose mode')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    config = yaml.safe_load(args.config_file)
+    charts_dir = args.charts_dir if args.charts_dir is not None else config['charts_dir']
+    if 'chart_cache_size' in config:
+        proj.set_chart_cache_size (config['chart_cache_size'])
+    if 'tile_cache_mb' in config:
+        tile_cache.tiles.set_budget (config['tile_cache_mb'])
+
+    app = QGuiApplication(sys.argv[:1])
+    pyavmap.configure_charts (charts_dir)
+    tiles = XyzTiles(charts_dir, args.cache_dir, args.cache_mb, args.tile_size)
+    serve(tiles, args.host, args.port, args.max_age)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import sys, os
+import gc
+import shutil
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+
+try:
+    from PyQt5.QtGui import QImage
+except:
+    from PyQt4.QtGui import QImage
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(top, 'make_tiles'))
+sys.path.insert(0, os.path.join(top, 'bench'))
+
+from pyavmap.chart_pack import ChartPack, PackWriter, PACK_EXT, TILE_ALIGN, \
+        TILE_PNG, TILE_RGB16, TILE_ARGB32, raw_stride
+from pyavmap.avchart_proj import AvChart
+from make_tiles import encode_tile, reduce_tile
+from synthetic_charts import chart_metadata, TILE_LAYOUT_LEVELS
+
+# Odd sizes, so edge tiles are partial and raw rows need padding
+CHART_WIDTH = 101
+CHART_HEIGHT = 70
+TILE_SIZE = 64
+
+# The pixels of a QImage as a height x width x 3 array
+def image_rgb(image):
+    image = image.convertToFormat(QImage.Format_RGB32)
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    rows = numpy.frombuffer(bits, dtype=numpy.uint8).reshape(image.height(), image.bytesPerLine())
+    pixels = rows[:, :image.width() * 4].reshape(image.height(), image.width(), 4)
+    # Format_RGB32 is 0xffRRGGBB in native (little endian) order
+    return pixels[:, :, 2::-1].copy()
+
+class TestPackFile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='avmap-test-')
+        self.fname = os.path.join(self.dir, 'test' + PACK_EXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        metadata = {'htm': '<html/>', 'world': '1\n0\n0\n-1\n0\n0\n', 'rotated': True,
+                    'layout': {'version': 2}, 'encoding': TILE_RGB16}
+        tiles = dict()
+        writer = PackWriter(self.fname, metadata)
+        # Added out of order, with lengths that are not multiples of TILE_ALIGN
+        for n,(level,x,y) in enumerate([(1,0,0), (0,2,1), (0,0,0), (0,1,0), (2,0,0)]):
+            data = bytes((n * 7 + i) & 0xff for i in range(13 + n * 5))
+            tiles[(level,x,y)] = data
+            writer.add(level, x, y, data)
+        self.assertFalse(os.path.exists(self.fname))
+        writer.close()
+        self.assertFalse(os.path.exists(self.fname + '.tmp'))
+
+        pack = ChartPack(self.fname)
+        try:
+            self.assertEqual(pack.metadata, metadata)
+            self.assertTrue(pack.rotated)
+            self.assertEqual(pack.encoding, TILE_RGB16)
+            self.assertEqual(set(pack.tiles()), set(tiles.keys()))
+            for (level,x,y),data in tiles.items():
+                self.assertEqual(pack.tile(level, x, y), data)
+                view = pack.tile_view(level, x, y)
+                self.assertEqual(view.tobytes(), data)
+                view.release()
+                self.assertEqual(pack.index[(level,x,y)][0] % TILE_ALIGN, 0)
+            self.assertIsNone(pack.tile(0, 5, 5))
+            self.assertIsNone(pack.tile_view(3, 0, 0))
+        finally:
+            pack.close()
+
+    def test_default_encoding(self):
+        writer = PackWriter(self.fname, {'htm': '', 'world': '', 'rotated': False, 'layout': {}})
+        writer.close()
+        pack = ChartPack(self.fname)
+        self.assertEqual(pack.encoding, TILE_PNG)
+        self.assertEqual(len(pack.tiles()), 0)
+        pack.close()
+
+    def test_not_a_pack(self):
+        with open(self.fname, 'wb') as f:
+            f.write(b'\x89PNG' + bytes(100))
+        self.assertRaises(RuntimeError, ChartPack, self.fname)
+
+    def test_truncated(self):
+        writer = PackWriter(self.fname, {'htm': '', 'world': '', 'rotated': False, 'layout': {}})
+        writer.add(0, 0, 0, bytes(100))
+        writer.close()
+        with open(self.fname, 'rb') as f:
+            data = f.read()
+        with open(self.fname, 'wb') as f:
+            f.write(data[:-4])
+        self.assertRaises(RuntimeError, ChartPack, self.fname)
+        with open(self.fname, 'wb') as f:
+            f.write(data[:10])
+        self.assertRaises(RuntimeError, ChartPack, self.fname)
+
+# Packs a small chart with make_tiles' encoder and reads it back through
+# AvChart as the map does
+class TestPackEncodings(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='avmap-test-')
+        rng = numpy.random.RandomState(5)
+        self.source = Image.fromarray(rng.randint(0, 256, (CHART_HEIGHT, CHART_WIDTH, 3),
+                                                  dtype=numpy.uint8), 'RGB')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # Writes the pack, and returns the chart and the source image of each tile
+    def make_pack(self, encoding):
+        name = 'Pack_' + encoding
+        chart_dir = os.path.join(self.dir, name)
+        os.makedirs(chart_dir)
+        base_name = os.path.join(chart_dir, name)
+        htm,world = chart_metadata(-104, -103, 36, 37, CHART_WIDTH, CHART_HEIGHT)
+        grids = list()
+        for level in range(2):
+            span = TILE_SIZE << level
+            grids.append([(CHART_WIDTH + span - 1) // span, (CHART_HEIGHT + span - 1) // span])
+        layout = {'version': TILE_LAYOUT_LEVELS, 'tile_size': TILE_SIZE,
+                  'width': CHART_WIDTH, 'height': CHART_HEIGHT, 'levels': grids}
+        writer = PackWriter(base_name + PACK_EXT, {'htm': htm, 'world': world, 'rotated': False,
+                                                   'layout': layout, 'encoding': encoding})
+        sources = dict()
+        for level,(columns,rows) in enumerate(grids):
+            span = TILE_SIZE << level
+            for x in range(columns):
+                for y in range(rows):
+                    box = (x*span, y*span, min((x+1)*span, CHART_WIDTH), min((y+1)*span, CHART_HEIGHT))
+                    tile = reduce_tile(self.source.crop(box), 1 << level)
+                    sources[(level,x,y)] = numpy.asarray(tile)
+                    writer.add(level, x, y, encode_tile(tile, encoding))
+        writer.close()
+        return AvChart(name, base_name, False),sources
+
+    def check_encoding(self, encoding, tolerance):
+        chart,sources = self.make_pack(encoding)
+        self.assertEqual(chart.pack.encoding, encoding)
+        self.assertEqual(chart.levels, 2)
+        for (level,x,y),expected in sources.items():
+            self.assertTrue(chart.tile_presence.present(level, x, y))
+            tile = chart.pack_tile(x, y, level)
+            self.assertFalse(tile.isNull())
+            self.assertEqual((tile.width(), tile.height()), chart.tile_pixel_size(x, y, level))
+            self.assertEqual((tile.height(), tile.width()), expected.shape[:2])
+            if encoding != TILE_PNG:
+                self.assertEqual(tile.bytesPerLine(), raw_stride(tile.width(), encoding))
+            diff = numpy.abs(image_rgb(tile).astype(int) - expected.astype(int))
+            self.assertLessEqual(diff.max(), tolerance,
+                                 "tile %d,%d at level %d of %s"%(x, y, level, encoding))
+            # Raw tiles hold a view of the memory map, which must go before it is closed
+            del tile
+        gc.collect()
+        chart.pack.close()
+
+    def test_png(self):
+        self.check_encoding(TILE_PNG, 0)
+
+    def test_argb32(self):
+        self.check_encoding(TILE_ARGB32, 0)
+
+    def test_rgb16(self):
+        # 5 bits of red and blue, 6 of green
+        self.check_encoding(TILE_RGB16, 7)
+
+    def test_rgb16_bits(self):
+        # Each 5-6-5 field lands where Format_RGB16 expects it
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255), (0, 0, 0), (8, 4, 8)]
+        tile = Image.new('RGB', (len(colors), 1))
+        tile.putdata(colors)
+        data = encode_tile(tile, TILE_RGB16)
+        self.assertEqual(len(data), raw_stride(len(colors), TILE_RGB16))
+        image = QImage(data, len(colors), 1, raw_stride(len(colors), TILE_RGB16), QImage.Format_RGB16)
+        self.assertEqual(image_rgb(image)[0].tolist(), [list(c) for c in colors])
+
+if __name__ == '__main__':
+    unittest.main()
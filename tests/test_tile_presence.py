@@ -0,0 +1,111 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import sys, os
+import shutil
+import tempfile
+import unittest
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(top, 'bench'))
+
+from pyavmap.avchart_proj import AvChart, TilePresence, decode_presence
+from synthetic_charts import make_chart, TILE_LAYOUT_LEGACY, TILE_LAYOUT_LEVELS
+
+# Tiles removed from the synthetic charts, as (level, x, y)
+MISSING = [(0, 0, 0), (0, 3, 1), (1, 1, 0), (2, 0, 0)]
+
+class TestTilePresence(unittest.TestCase):
+    def test_bits(self):
+        presence = TilePresence([(5, 3), (3, 2)])
+        tiles = [(0, 0, 0), (0, 4, 2), (0, 2, 1), (1, 2, 1)]
+        for t in tiles:
+            presence.add(*t)
+        for level,(columns,rows) in enumerate(presence.grids):
+            for x in range(-1, columns + 1):
+                for y in range(-1, rows + 1):
+                    self.assertEqual(presence.present(level, x, y), (level, x, y) in tiles)
+        self.assertFalse(presence.present(2, 0, 0))
+        self.assertEqual(presence.count(0), 3)
+        self.assertEqual(presence.count(1), 1)
+
+    def test_encode(self):
+        presence = TilePresence([(9, 7), (5, 4)])
+        for x,y in [(0, 0), (8, 6), (3, 5), (7, 0)]:
+            presence.add(0, x, y)
+        presence.add(1, 4, 3)
+        decoded = decode_presence(presence.encode())
+        self.assertEqual(decoded.grids, presence.grids)
+        self.assertEqual(decoded.bits, presence.bits)
+
+# Synthetic charts with some tiles removed, checked against the files
+class TestChartPresence(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='avmap-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make(self, layout, **kwargs):
+        name = 'Layout%d'%layout
+        base_name = make_chart(self.dir, 'Sectional', name, -104, -102, 36, 37, 300, 200,
+                               layout=layout, tile_size=64, grid=4, **kwargs)
+        return name,base_name
+
+    def check_files(self, chart):
+        for level in range(chart.levels + 1):
+            columns,rows = chart.tile_presence.grids[min(level, chart.levels - 1)]
+            for x in range(-1, columns + 2):
+                for y in range(-1, rows + 2):
+                    on_disk = x >= 0 and y >= 0 and os.path.exists(chart.tile_file(x, y, level))
+                    self.assertEqual(chart.tile_presence.present(level, x, y), on_disk,
+                                     "tile %d,%d at level %d"%(x, y, level))
+                    self.assertEqual(chart.get_tile_pixmap(x, y, just_check=True, level=level)[2]
+                                     is not None, on_disk)
+
+    def check_layout(self, layout):
+        name,base_name = self.make(layout)
+        chart = AvChart(name, base_name, False)
+        for level,x,y in MISSING:
+            os.remove(chart.tile_file(x, y, level))
+        chart = AvChart(name, base_name, False)
+        self.assertEqual(chart.layout_version, layout)
+        self.check_files(chart)
+        # As read from a chart catalog
+        cataloged = AvChart(name, base_name, False, chart.get_info())
+        self.assertEqual(cataloged.tile_presence.grids, chart.tile_presence.grids)
+        self.assertEqual(cataloged.tile_presence.bits, chart.tile_presence.bits)
+        self.check_files(cataloged)
+
+    def test_levels_layout(self):
+        self.check_layout(TILE_LAYOUT_LEVELS)
+
+    def test_legacy_layout(self):
+        self.check_layout(TILE_LAYOUT_LEGACY)
+
+    def test_pack(self):
+        name,base_name = self.make(TILE_LAYOUT_LEVELS, pack=True)
+        chart = AvChart(name, base_name, False)
+        self.assertIsNotNone(chart.pack)
+        tiles = set(chart.pack.tiles())
+        for level,(columns,rows) in enumerate(chart.tile_presence.grids):
+            for x in range(-1, columns + 1):
+                for y in range(-1, rows + 1):
+                    self.assertEqual(chart.tile_presence.present(level, x, y), (level, x, y) in tiles)
+        chart.pack.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#  Copyright (c) 2019 Garrett Herschleb
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+import unittest
+
+import numpy
+
+from pyavmap.track import TrackHistory, simplify
+
+class TestTrackHistory(unittest.TestCase):
+    def test_empty(self):
+        h = TrackHistory(4)
+        self.assertEqual(len(h), 0)
+        self.assertIsNone(h.first())
+        self.assertIsNone(h.last())
+        lons,lats = h.points()
+        self.assertEqual(len(lons), 0)
+        self.assertEqual(len(lats), 0)
+
+    def test_fill_without_drop(self):
+        h = TrackHistory(4)
+        for i in range(4):
+            self.assertFalse(h.append(i, -i))
+        self.assertEqual(len(h), 4)
+        self.assertEqual(h.first(), (0, 0))
+        self.assertEqual(h.last(), (3, -3))
+        lons,lats = h.points()
+        self.assertEqual(lons.tolist(), [0, 1, 2, 3])
+        self.assertEqual(lats.tolist(), [0, -1, -2, -3])
+
+    def test_wraparound(self):
+        h = TrackHistory(4)
+        dropped = [h.append(i, i * 10) for i in range(11)]
+        # Only appends to a full history drop a point
+        self.assertEqual(dropped, [False] * 4 + [True] * 7)
+        self.assertEqual(len(h), 4)
+        self.assertEqual(h.first(), (7, 70))
+        self.assertEqual(h.last(), (10, 100))
+        lons,lats = h.points()
+        self.assertEqual(lons.tolist(), [7, 8, 9, 10])
+        self.assertEqual(lats.tolist(), [70, 80, 90, 100])
+
+    def test_wraparound_every_offset(self):
+        # points() is right whichever slot the oldest point is in
+        capacity = 5
+        for extra in range(2 * capacity):
+            h = TrackHistory(capacity)
+            n = capacity + extra
+            for i in range(n):
+                h.append(i, -i)
+            lons,lats = h.points()
+            self.assertEqual(lons.tolist(), list(range(n - capacity, n)))
+            self.assertEqual(lats.tolist(), [-i for i in range(n - capacity, n)])
+
+    def test_clear(self):
+        h = TrackHistory(3)
+        for i in range(5):
+            h.append(i, i)
+        h.clear()
+        self.assertEqual(len(h), 0)
+        self.assertIsNone(h.last())
+        self.assertFalse(h.append(1, 2))
+        self.assertEqual(h.points()[0].tolist(), [1])
+
+    def test_minimum_capacity(self):
+        h = TrackHistory(0)
+        self.assertEqual(h.capacity, 2)
+        self.assertFalse(h.append(0, 0))
+        self.assertFalse(h.append(1, 1))
+        self.assertTrue(h.append(2, 2))
+        self.assertEqual(h.first(), (1, 1))
+
+# Distance of each point from the line through a and b
+def line_distance(xs, ys, a, b):
+    dx = xs[b] - xs[a]
+    dy = ys[b] - ys[a]
+    length = numpy.hypot(dx, dy)
+    if length == 0:
+        return numpy.hypot(xs - xs[a], ys - ys[a])
+    return numpy.abs((xs - xs[a]) * dy - (ys - ys[a]) * dx) / length
+
+class TestSimplify(unittest.TestCase):
+    def check_within_tolerance(self, xs, ys, tolerance):
+        keep = simplify(xs, ys, tolerance)
+        self.assertEqual(keep[0], 0)
+        self.assertEqual(keep[-1], len(xs) - 1)
+        self.assertTrue((numpy.diff(keep) > 0).all())
+        for a,b in zip(keep[:-1], keep[1:]):
+            if b - a < 2:
+                continue
+            dist = line_distance(xs, ys, a, b)[a+1:b]
+            self.assertLessEqual(dist.max(), tolerance + 1e-9)
+        return keep
+
+    def test_short(self):
+        for n in range(3):
+            xs = numpy.arange(n, dtype=float)
+            self.assertEqual(simplify(xs, xs, 1.0).tolist(), list(range(n)))
+
+    def test_straight_line(self):
+        xs = numpy.linspace(0, 1000, 200)
+        ys = xs * 0.5 + 3
+        self.assertEqual(simplify(xs, ys, 0.1).tolist(), [0, 199])
+
+    def test_corner_kept(self):
+        xs = numpy.array([0.0, 50, 100, 100, 100])
+        ys = numpy.array([0.0, 0, 0, 50, 100])
+        self.assertEqual(simplify(xs, ys, 1.0).tolist(), [0, 2, 4])
+
+    def test_tolerance(self):
+        rng = numpy.random.RandomState(17)
+        # A wandering track: steady heading changes plus noise
+        heading = numpy.cumsum(rng.normal(0, 0.15, 2000))
+        xs = numpy.cumsum(numpy.cos(heading) * 5) + rng.normal(0, 0.3, 2000)
+        ys = numpy.cumsum(numpy.sin(heading) * 5) + rng.normal(0, 0.3, 2000)
+        previous = None
+        for tolerance in (0.25, 1.0, 4.0, 16.0):
+            keep = self.check_within_tolerance(xs, ys, tolerance)
+            self.assertLess(len(keep), len(xs))
+            if previous is not None:
+                self.assertLessEqual(len(keep), previous)
+            previous = len(keep)
+
+    def test_closed_loop(self):
+        # The first and last points coincide, so the first split is by
+        # distance from that point
+        angle = numpy.linspace(0, 2 * numpy.pi, 100)
+        xs = numpy.cos(angle) * 100
+        ys = numpy.sin(angle) * 100
+        self.check_within_tolerance(xs, ys, 0.5)
+
+if __name__ == '__main__':
+    unittest.main()